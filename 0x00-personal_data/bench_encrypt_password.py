@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Benchmark of hash_passwords / verify_many across worker counts
+"""
+import argparse
+import os
+import time
+
+encrypt_password = __import__('encrypt_password')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=64)
+    parser.add_argument('--processes', action='store_true')
+    args = parser.parse_args()
+
+    passwords = ["password{}".format(i) for i in range(args.count)]
+    workers = 1
+    while workers <= 2 * (os.cpu_count() or 1):
+        start = time.perf_counter()
+        pairs = [(hashed, pwd) for pwd, hashed in
+                 encrypt_password.hash_passwords(passwords, workers,
+                                                 args.processes)]
+        hashing = time.perf_counter() - start
+        start = time.perf_counter()
+        assert all(ok for _, ok in encrypt_password.verify_many(
+            pairs, workers, args.processes))
+        verifying = time.perf_counter() - start
+        print("{:>3} workers: hash {:>7.1f}/s | verify {:>7.1f}/s".format(
+            workers, args.count / hashing, args.count / verifying))
+        workers *= 2
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Benchmark of get_db() per operation against a pooled checkout
+
+Uses MySQL when PERSONAL_DATA_DB_NAME is set, a local SQLite stand-in
+otherwise.
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+filtered_logger = __import__('filtered_logger')
+
+
+def select_one(db):
+    """One small operation on the connection"""
+    cursor = db.cursor()
+    cursor.execute("SELECT 1")
+    cursor.fetchall()
+    cursor.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=2000)
+    args = parser.parse_args()
+
+    connect = filtered_logger.get_db
+    if not os.getenv("PERSONAL_DATA_DB_NAME"):
+        path = os.path.join(tempfile.mkdtemp(), 'stand_in.db')
+
+        def connect():
+            """SQLite stand-in for get_db"""
+            return sqlite3.connect(path, check_same_thread=False)
+
+    start = time.perf_counter()
+    for _ in range(args.count):
+        db = connect()
+        select_one(db)
+        db.close()
+    per_call = time.perf_counter() - start
+
+    pool = filtered_logger.ConnectionPool(connect, size=1)
+    start = time.perf_counter()
+    for _ in range(args.count):
+        with pool.connection() as db:
+            select_one(db)
+    pooled = time.perf_counter() - start
+    pool.close()
+
+    print("per-call connect: {:>9.0f} ops/s".format(args.count / per_call))
+    print("pooled checkout:  {:>9.0f} ops/s".format(args.count / pooled))
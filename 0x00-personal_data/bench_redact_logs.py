@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Benchmark of redact_logs.redact_file on a generated log file
+"""
+import argparse
+import os
+import tempfile
+import time
+
+redact_file = __import__('redact_logs').redact_file
+
+LINE = ("[HOLBERTON] user_data INFO 2019-11-19 18:24:25,105: name={0}; "
+        "email={0}@example.com; phone=(473) 401-4253; ssn=261-72-6780; "
+        "password=K5?BMNv; ip=60ed:c396:2ff:244:bbd0:9208:26f2:93ea; "
+        "last_login=2019-11-14 06:14:24; user_agent=Mozilla/5.0;\n")
+
+
+def generate(path: str, size: int):
+    """Write about size bytes of unredacted log lines to path"""
+    block = ''.join(LINE.format('user{}'.format(i))
+                    for i in range(10000)).encode()
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            written += f.write(block)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=int, default=2048)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source.log')
+        generate(source, args.size_mb << 20)
+        size = os.path.getsize(source)
+        workers = 1
+        while workers <= (os.cpu_count() or 1):
+            start = time.perf_counter()
+            redact_file(source, os.path.join(tmp, 'redacted.log'), workers)
+            elapsed = time.perf_counter() - start
+            print("{:>3} workers: {:>8.1f} MB/s".format(
+                workers, size / elapsed / (1 << 20)))
+            workers *= 2
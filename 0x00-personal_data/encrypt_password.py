@@ -1,19 +1,26 @@
 #!/usr/bin/env python3
 """Hashing password"""
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Tuple
+import os
+import time
 import bcrypt
 
 
-def hash_password(password: str) -> bytes:
+def hash_password(password: str, rounds: int = None) -> bytes:
     """hash_password function that expects one string argument name password
     and returns a salted, hashed password, which is a byte string
 
     Args:
         password (str): password to be hashed
+        rounds (int): bcrypt cost factor, defaults to the library's one
 
     Returns:
         bytes: hashed password
     """
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt() if rounds is None else bcrypt.gensalt(rounds)
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed_password
 
@@ -29,3 +36,100 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
         bool: True or False
     """
     return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+
+
+def hash_cost(hashed_password: bytes) -> int:
+    """Read the cost factor of a bcrypt hash ($2b$<cost>$...)
+
+    Args:
+        hashed_password (bytes): hashed password
+
+    Returns:
+        int: the cost factor
+    """
+    return int(hashed_password.split(b'$')[2])
+
+
+def calibrate_cost(target_ms: float = 50, min_rounds: int = 4,
+                   max_rounds: int = 31) -> int:
+    """Pick the cost factor for which a verification on this machine takes
+    at most about target_ms; each extra round doubles the time so the
+    rounds are measured upwards until the next one would exceed it
+
+    Args:
+        target_ms (float): verification latency budget in milliseconds
+        min_rounds (int): lowest cost factor allowed
+        max_rounds (int): highest cost factor allowed
+
+    Returns:
+        int: the cost factor
+    """
+    password = b'calibration'
+    rounds = min_rounds
+    while rounds < max_rounds:
+        hashed_password = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+        start = time.perf_counter()
+        bcrypt.checkpw(password, hashed_password)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms * 2 > target_ms:
+            break
+        rounds += 1
+    return rounds
+
+
+def _bounded_map(func: Callable, iterable: Iterable, workers: int = None,
+                 processes: bool = False) -> Iterator[Tuple[object, object]]:
+    """Run func over iterable in a pool and yield (item, result) as soon
+    as each call completes, keeping at most 4 * workers calls in flight
+    """
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    items = iter(iterable)
+    with executor(workers) as pool:
+        pending = {}
+        for item in islice(items, 4 * workers):
+            pending[pool.submit(func, *item)] = item
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+            for item in islice(items, len(done)):
+                pending[pool.submit(func, *item)] = item
+
+
+def hash_passwords(passwords: Iterable[str], workers: int = None,
+                   processes: bool = False) -> Iterator[Tuple[str, bytes]]:
+    """Hash many passwords in parallel, bcrypt releases the GIL so a
+    thread pool is enough by default
+
+    Args:
+        passwords (Iterable[str]): passwords to be hashed
+        workers (int): pool size, defaults to the CPU count
+        processes (bool): use a process pool instead of threads
+
+    Returns:
+        Iterator[Tuple[str, bytes]]: (password, hashed password) pairs in
+                                     completion order
+    """
+    results = _bounded_map(hash_password, ((pwd,) for pwd in passwords),
+                           workers, processes)
+    for (password,), hashed_password in results:
+        yield password, hashed_password
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]], workers: int = None,
+                processes: bool = False
+                ) -> Iterator[Tuple[Tuple[bytes, str], bool]]:
+    """Check many (hashed_password, password) pairs in parallel
+
+    Args:
+        pairs (Iterable[Tuple[bytes, str]]): pairs to be checked
+        workers (int): pool size, defaults to the CPU count
+        processes (bool): use a process pool instead of threads
+
+    Returns:
+        Iterator[Tuple[Tuple[bytes, str], bool]]: (pair, True or False) in
+                                                  completion order
+    """
+    return _bounded_map(is_valid, (tuple(pair) for pair in pairs),
+                        workers, processes)
@@ -1,13 +1,53 @@
 #!/usr/bin/env python3
 """Filter file"""
-from typing import List
+from typing import Callable, Iterator, List, Pattern, Sequence, Tuple
+from contextlib import contextmanager
+from functools import lru_cache
+from logging.handlers import QueueHandler
+import argparse
+import atexit
+import hashlib
+import json
+import queue
 import re
 import logging
 import os
+import threading
 from os import environ
 from mysql.connector import connection
 
 
+@lru_cache(maxsize=128)
+def redaction_pattern(fields: Tuple[str, ...], separator: str) -> Pattern:
+    """Compile a single pattern matching any of the fields to obfuscate
+
+    Args:
+        fields (Tuple[str, ...]): Field names to obfuscate
+        separator (str): Character separating the fields in a log line
+
+    Returns:
+        Pattern: Compiled pattern, cached per (fields, separator)
+    """
+    names = sorted(set(fields), key=len, reverse=True)
+    return re.compile(r'({})=[^{}]+'.format(
+        '|'.join(re.escape(name) for name in names), re.escape(separator)))
+
+
+def redact(pattern: Pattern, redaction: str, message: str) -> str:
+    """Obfuscate every field matched by pattern in a single pass
+
+    Args:
+        pattern (Pattern): Pattern built by redaction_pattern
+        redaction (str): String replacing the field values
+        message (str): The log line
+
+    Returns:
+        str: The log message obfuscated
+    """
+    return pattern.sub(lambda match: match.group(1) + '=' + redaction,
+                       message)
+
+
 def filter_datum(
         fields: List[str],
         redaction: str,
@@ -28,12 +68,10 @@ def filter_datum(
     return:
     str: The log message obfuscated
     """
-    for field in fields:
-        message = re.sub(
-            r'{}=[^{}]+'.format(field, separator),
-            '{}={}'.format(field, redaction),
-            message)
-    return message
+    if not fields:
+        return message
+    return redact(redaction_pattern(tuple(fields), separator),
+                  redaction, message)
 
 
 class RedactingFormatter(logging.Formatter):
@@ -53,6 +91,7 @@ class RedactingFormatter(logging.Formatter):
         """
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self._pattern = redaction_pattern(tuple(fields), self.SEPARATOR)
 
     def format(self, record: logging.LogRecord) -> str:
         """ filter values in incoming log records using filter_datum
@@ -60,34 +99,174 @@ class RedactingFormatter(logging.Formatter):
         Args:
             record (logging.LogRecord): values in incoming log records
         """
-        record.msg = filter_datum(self.fields,
-                                  self.REDACTION, record.msg,
-                                  self.SEPARATOR)
+        if self.fields:
+            record.msg = redact(self._pattern, self.REDACTION, record.msg)
         return super().format(record)
 
 
 PII_FIELDS = ("email", "ssn", "password", "phone", "name")
 
 
-def get_logger() -> logging.Logger:
+class RecordQueueHandler(QueueHandler):
+    """QueueHandler putting the raw records on a bounded queue, the
+    redaction and formatting are left to the listener thread
+    """
+
+    def __init__(self, record_queue: queue.Queue, policy: str = "drop",
+                 timeout: float = None):
+        """Initialize the handler
+
+        Args:
+            record_queue (queue.Queue): Bounded queue shared with the listener
+            policy (str): "drop" to discard records when the queue is full,
+                          "block" to wait for a free slot
+            timeout (float): With "block", seconds to wait before dropping
+        """
+        if policy not in ("drop", "block"):
+            raise ValueError("policy must be 'drop' or 'block'")
+        super().__init__(record_queue)
+        self.policy = policy
+        self.timeout = timeout
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Enqueue the record as is, nothing is formatted by the caller"""
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        """Put the record on the queue following the full queue policy"""
+        try:
+            self.queue.put(record, self.policy == "block", self.timeout)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchListener(threading.Thread):
+    """Background thread formatting queued records and writing them to
+    the stream by batches
+    """
+
+    def __init__(self, record_queue: queue.Queue,
+                 handler: logging.StreamHandler, batch_size: int = 256):
+        """Initialize the listener
+
+        Args:
+            record_queue (queue.Queue): Queue filled by RecordQueueHandler
+            handler (logging.StreamHandler): Holds the formatter and stream
+            batch_size (int): Maximum number of records written at once
+        """
+        super().__init__(name="user_data-listener", daemon=True)
+        self.queue = record_queue
+        self.handler = handler
+        self.batch_size = batch_size
+
+    def run(self):
+        """Drain the queue until stop() enqueues the sentinel"""
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [record for record in batch if record is not None]
+            self.write(batch)
+
+    def write(self, batch: List[logging.LogRecord]):
+        """Format the batch and write it with a single flush"""
+        handler = self.handler
+        lines = []
+        for record in batch:
+            if record.levelno < handler.level or not handler.filter(record):
+                continue
+            try:
+                lines.append(handler.format(record) + handler.terminator)
+            except Exception:
+                handler.handleError(record)
+        if not lines:
+            return
+        with handler.lock:
+            handler.stream.write(''.join(lines))
+            handler.flush()
+
+    def stop(self):
+        """Write the pending records and wait for the thread to end"""
+        self.queue.put(None)
+        self.join()
+
+
+_export_logger = None
+_export_logger_lock = threading.Lock()
+
+
+def get_logger(async_mode: bool = None) -> logging.Logger:
     """The logger should be named "user_data" and only log up to logging.INFO
     level. It should not propagate messages to other loggers.
     It should have a StreamHandler with RedactingFormatter as formatter
 
+    The handler is only attached once, later calls return the same logger.
+    With async_mode (or PERSONAL_DATA_LOG_ASYNC=1) the records go through
+    a bounded queue (PERSONAL_DATA_LOG_QUEUE_SIZE, default 10000) to a
+    BatchListener thread; PERSONAL_DATA_LOG_POLICY is "drop" (default) or
+    "block" when the queue is full.
+
     Returns:
         logging.Logger:
     """
     logger = logging.getLogger("user_data")
+    if logger.handlers:
+        return logger
+    return _setup_logger(logger, RedactingFormatter(fields=list(PII_FIELDS)),
+                         async_mode)
+
+
+def _get_export_logger(async_mode: bool = None) -> logging.Logger:
+    """Logger of the export lines, which row_formatter already redacted:
+    same output as get_logger, without a second redaction pass
+
+    It is kept out of the logging registry (logging.getLogger can't
+    return it), only main logs to it.
+    """
+    global _export_logger
+    with _export_logger_lock:
+        if _export_logger is None:
+            _export_logger = _setup_logger(
+                logging.Logger("user_data"),
+                logging.Formatter(RedactingFormatter.FORMAT), async_mode)
+    return _export_logger
+
+
+def _setup_logger(logger: logging.Logger, formatter: logging.Formatter,
+                  async_mode: bool = None) -> logging.Logger:
+    """Attach to logger a stream handler using formatter, directly or
+    through the queue and listener thread of the async mode
+    """
     logger.setLevel(logging.INFO)
     logger.propagate = False
 
     stream_handler = logging.StreamHandler()
     stream_handler.setLevel(logging.INFO)
-
-    formatter = RedactingFormatter(fields=list(PII_FIELDS))
     stream_handler.setFormatter(formatter)
 
-    logger.addHandler(stream_handler)
+    if async_mode is None:
+        async_mode = os.getenv("PERSONAL_DATA_LOG_ASYNC", "0") == "1"
+    if not async_mode:
+        logger.addHandler(stream_handler)
+        return logger
+
+    record_queue = queue.Queue(
+        int(os.getenv("PERSONAL_DATA_LOG_QUEUE_SIZE", "10000")))
+    queue_handler = RecordQueueHandler(
+        record_queue, os.getenv("PERSONAL_DATA_LOG_POLICY", "drop"))
+    queue_handler.setLevel(logging.INFO)
+    listener = BatchListener(record_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(queue_handler)
 
     return logger
 
@@ -104,20 +283,336 @@ def get_db() -> connection.MySQLConnection:
         host=host, database=database)
 
 
-def main():
+class ConnectionPool:
+    """Pool of database connections with health checks and checkout
+    timeouts, connections are opened lazily up to size
     """
-    Main function to retrieve user data from database and log to console
+
+    def __init__(self, connect: Callable = None, size: int = 5,
+                 timeout: float = 30.0):
+        """Initialize the pool
+
+        Args:
+            connect (Callable): Opens a new connection, defaults to get_db
+            size (int): Maximum number of connections checked out at once
+            timeout (float): Seconds to wait for a free connection
+        """
+        if size < 1:
+            raise ValueError("size must be a positive integer")
+        self._connect = connect or get_db
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._checked_out = set()
+        self._lock = threading.Lock()
+        self.size = size
+        self.timeout = timeout
+
+    @staticmethod
+    def is_healthy(db) -> bool:
+        """Check an idle connection before handing it out
+
+        Args:
+            db: MySQL connection (is_connected pings the server) or any
+                DB-API connection (checked with SELECT 1)
+        """
+        try:
+            if hasattr(db, "is_connected"):
+                return db.is_connected()
+            cursor = db.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self, timeout: float = None):
+        """Check out a connection, reusing a healthy idle one if any
+
+        Args:
+            timeout (float): Seconds to wait, defaults to the pool's one
+
+        Raises:
+            TimeoutError: If no connection is released in time
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(
+                "no database connection available after {}s".format(timeout))
+        try:
+            while True:
+                try:
+                    db = self._idle.get_nowait()
+                except queue.Empty:
+                    db = self._connect()
+                    break
+                if self.is_healthy(db):
+                    break
+                self._discard(db)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._checked_out.add(id(db))
+        return db
+
+    def release(self, db):
+        """Give a checked out connection back to the pool, rolling back
+        the transaction it left open (autocommit is off by default) so
+        the next borrower gets no stale snapshot nor locks; a connection
+        that can't roll back is closed instead
+
+        Raises:
+            ValueError: If db is not checked out from this pool
+        """
+        with self._lock:
+            if id(db) not in self._checked_out:
+                raise ValueError("connection is not checked out")
+            self._checked_out.discard(id(db))
+        try:
+            db.rollback()
+        except Exception:
+            self._discard(db)
+        else:
+            self._idle.put(db)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """Context manager checking out a connection and releasing it,
+        which rolls back what was not committed
+        """
+        db = self.acquire(timeout)
+        try:
+            yield db
+        finally:
+            self.release(db)
+
+    def close(self):
+        """Close the idle connections"""
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+    @staticmethod
+    def _discard(db):
+        """Close a connection, ignoring a dead link"""
+        try:
+            db.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_db_pool() -> ConnectionPool:
+    """Returns the process-wide pool of connectors to the database, opened
+    with the PERSONAL_DATA_DB_* variables of get_db and sized by
+    PERSONAL_DATA_DB_POOL_SIZE (default 5) and
+    PERSONAL_DATA_DB_POOL_TIMEOUT (seconds, default 30)
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                get_db,
+                int(os.getenv("PERSONAL_DATA_DB_POOL_SIZE", "5")),
+                float(os.getenv("PERSONAL_DATA_DB_POOL_TIMEOUT", "30")))
+            atexit.register(_pool.close)
+        return _pool
+
+
+def row_formatter(description: Sequence[tuple],
+                  fields: Sequence[str] = PII_FIELDS
+                  ) -> Callable[[tuple], str]:
+    """Work out once, from a cursor description, which columns hold PII
+    and return a function formatting a row into a redacted log line
+
+    Args:
+        description (Sequence[tuple]): The cursor.description of the query
+        fields (Sequence[str]): Fields to obfuscate
+
+    Returns:
+        Callable[[tuple], str]: Formatter of one row
+    """
+    redaction = RedactingFormatter.REDACTION
+    pattern = redaction_pattern(tuple(fields), RedactingFormatter.SEPARATOR)
+    columns = []
+    for column in description:
+        name = column[0]
+        if pattern.search('{}=_'.format(name)):
+            columns.append(('{}={}; '.format(name, redaction), None))
+        else:
+            columns.append((None, '{}='.format(name)))
+
+    def format_row(row: tuple) -> str:
+        """Format a row, redacting PII columns without any regex scan"""
+        parts = []
+        for (constant, prefix), value in zip(columns, row):
+            if constant is not None:
+                parts.append(constant)
+                continue
+            value = str(value)
+            if '=' in value:
+                value = redact(pattern, redaction, value)
+            parts.append('{}{}; '.format(prefix, value))
+        return ''.join(parts).strip()
+
+    return format_row
+
+
+def stream_rows(cursor, batch_size: int = 1000) -> Iterator[List[str]]:
+    """Yield redacted log lines by batches of fetchmany(batch_size)
+
+    Args:
+        cursor: DB-API cursor on which the query has been executed
+        batch_size (int): Number of rows fetched at once
+
+    Returns:
+        Iterator[List[str]]: Batches of redacted lines
+    """
+    format_row = row_formatter(cursor.description)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield [format_row(row) for row in rows]
+
+
+def export_users(cursor, logger: logging.Logger,
+                 batch_size: int = 1000) -> int:
+    """Log every row of the users table, redacted, with flat memory
+
+    Args:
+        cursor: DB-API cursor (MySQL unbuffered, SQLite, ...)
+        logger (logging.Logger): Logger receiving the redacted lines
+        batch_size (int): Number of rows fetched at once
+
+    Returns:
+        int: The number of rows exported
     """
-    db = get_db()
-    cursor = db.cursor()
     cursor.execute("SELECT * FROM users;")
-    field_names = [i[0] for i in cursor.description]
+    count = 0
+    for lines in stream_rows(cursor, batch_size):
+        for line in lines:
+            logger.info(line)
+        count += len(lines)
+    return count
+
+
+def load_watermark(path: str) -> dict:
+    """Read the state of the last incremental export, {} if none"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_watermark(path: str, state: dict):
+    """Write the state of the incremental export atomically"""
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
 
-    logger = get_logger()
 
-    for row in cursor:
-        str_row = ''.join(f'{f}={str(r)}; ' for r, f in zip(row, field_names))
-        logger.info(str_row.strip())
+def export_users_since(cursor, logger: logging.Logger, state: dict,
+                       column: str = 'last_login', batch_size: int = 1000,
+                       placeholder: str = '%s') -> dict:
+    """Log, redacted, only the rows whose watermark column is at or past
+    the one of the previous run, in the column order
+
+    Rows sharing the previous watermark value are skipped when already
+    exported; they are recognized by a SHA-256 digest of the row, so the
+    state file never holds personal data. The table has no primary key,
+    so rows whose watermark is NULL are read on every run and exported
+    once, deduplicated the same way.
+
+    Args:
+        cursor: DB-API cursor
+        logger (logging.Logger): Logger receiving the redacted lines
+        state (dict): State returned by the previous run ({} the first time)
+        column (str): Watermark column, updated on every change of a row
+        batch_size (int): Number of rows fetched at once
+        placeholder (str): Parameter marker of the driver ('?' for SQLite)
+
+    Returns:
+        dict: The new state, to be saved once the export succeeded
+    """
+    if not column.isidentifier():
+        raise ValueError("invalid watermark column: {}".format(column))
+    if state.get('column', column) != column:
+        state = {}
+    if state.get('value') is None:
+        cursor.execute("SELECT * FROM users ORDER BY {};".format(column))
+    else:
+        cursor.execute("SELECT * FROM users WHERE {0} >= {1} OR {0} IS NULL "
+                       "ORDER BY {0};".format(column, placeholder),
+                       (state['value'],))
+    names = [description[0] for description in cursor.description]
+    index = names.index(column)
+    format_row = row_formatter(cursor.description)
+    value = state.get('value')
+    seen = set(state.get('seen', ()))
+    boundary = set(seen)
+    null_seen = set(state.get('null_seen', ()))
+    nulls = set()
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            digest = hashlib.sha256(repr(tuple(row)).encode()).hexdigest()
+            row_value = row[index]
+            if row_value is None:
+                nulls.add(digest)
+                if digest in null_seen:
+                    continue
+            elif str(row_value) != value:
+                value = str(row_value)
+                boundary = set()
+            elif digest in seen:
+                continue
+            if row_value is not None:
+                boundary.add(digest)
+            logger.info(format_row(row))
+    return {'column': column, 'value': value, 'seen': sorted(boundary),
+            'null_seen': sorted(nulls)}
+
+
+def main(argv: List[str] = None):
+    """
+    Main function to retrieve user data from database and log to console
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='rows fetched from the server at once')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only export rows changed since the last run')
+    parser.add_argument('--state-file', default='.export_state.json',
+                        help='watermark of the incremental export')
+    parser.add_argument('--watermark-column', default='last_login')
+    args = parser.parse_args(argv)
+    if args.batch_size < 1:
+        parser.error('--batch-size must be a positive integer')
+
+    db = get_db()
+    cursor = db.cursor(buffered=False)
+    logger = _get_export_logger()
+
+    if args.incremental:
+        state = export_users_since(cursor, logger,
+                                   load_watermark(args.state_file),
+                                   args.watermark_column, args.batch_size)
+        save_watermark(args.state_file, state)
+    else:
+        export_users(cursor, logger, args.batch_size)
 
     cursor.close()
     db.close()
@@ -7,6 +7,7 @@ from api.v1.views import app_views
 from flask import Flask, jsonify, abort, request
 from flask_cors import (CORS, cross_origin)
 from api.v1.auth.auth import Auth
+from models.base import refresh
 from api.v1.auth.basic_auth import BasicAuth
 import os
 
@@ -45,6 +46,7 @@ def forbidden(error) -> str:
 def before_request():
     """Filter each request
     """
+    refresh()
     if auth is None:
         return
     paths = ['/api/v1/status/', '/api/v1/unauthorized/', '/api/v1/forbidden/']
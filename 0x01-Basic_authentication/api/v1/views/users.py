@@ -2,18 +2,114 @@
 """ Module of Users views
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, jsonify, request
 from models.user import User
+from urllib.parse import urlencode
+import base64
+import json
+import zlib
+
+
+PAGE_LIMIT = 100
+PAGE_MAX_LIMIT = 1000
+EXPORT_BATCH = 100
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters:
+      - limit (optional): number of users per page (default 100, max 1000)
+      - cursor (optional): next_cursor of the previous page
+      - fields (optional): comma separated attributes to return
+      - all (optional): all=1 returns the whole list, unpaginated
     Return:
-      - list of all User objects JSON represented
+      - page of User objects JSON represented by increasing ID, with the
+        next_cursor (also in a Link header), null on the last page
+      - 400 if a parameter is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    if request.args.get('all') in ('1', 'true'):
+        all_users = [user.to_json() for user in User.all()]
+        return jsonify(all_users)
+
+    try:
+        limit = int(request.args.get('limit', PAGE_LIMIT))
+    except ValueError:
+        limit = 0
+    if limit < 1 or limit > PAGE_MAX_LIMIT:
+        return jsonify({'error': "limit must be between 1 and {}".format(
+            PAGE_MAX_LIMIT)}), 400
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = base64.urlsafe_b64decode(cursor.encode()).decode()
+        except Exception:
+            after = None
+        if not after or \
+                base64.urlsafe_b64encode(after.encode()).decode() != cursor:
+            return jsonify({'error': "invalid cursor"}), 400
+    fields = request.args.get('fields')
+    fields = [f for f in fields.split(',') if f] if fields else None
+
+    users = User.page(after, limit)
+    page = []
+    for user in users:
+        user_json = user.to_json()
+        if fields is not None:
+            user_json = {f: user_json[f] for f in fields if f in user_json}
+        page.append(user_json)
+
+    next_cursor = None
+    if len(users) == limit:
+        next_cursor = base64.urlsafe_b64encode(users[-1].id.encode()).decode()
+    response = jsonify({'users': page, 'next_cursor': next_cursor})
+    if next_cursor is not None:
+        params = {'limit': limit, 'cursor': next_cursor}
+        if fields is not None:
+            params['fields'] = ','.join(fields)
+        response.headers['Link'] = '<{}?{}>; rel="next"'.format(
+            request.base_url, urlencode(params))
+    return response
+
+
+@app_views.route('/users/export', methods=['GET'], strict_slashes=False)
+def export_users() -> str:
+    """ GET /api/v1/users/export
+    Query parameters:
+      - format (optional): only ndjson is supported
+      - gzip (optional): gzip=1 compresses the stream (also done when the
+        Accept-Encoding header accepts gzip with a non-zero quality)
+    Return:
+      - stream of User objects JSON represented, one per line
+      - 400 if the format isn't supported
+    """
+    if request.args.get('format', 'ndjson') != 'ndjson':
+        return jsonify({'error': "format must be ndjson"}), 400
+    compress = request.args.get('gzip') in ('1', 'true') or \
+        request.accept_encodings['gzip'] > 0
+
+    def generate():
+        lines = []
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        for user in User.iterate():
+            lines.append(json.dumps(user.to_json()) + '\n')
+            if len(lines) < EXPORT_BATCH:
+                continue
+            chunk = ''.join(lines).encode()
+            lines = []
+            yield compressor.compress(chunk) if compress else chunk
+        chunk = ''.join(lines).encode()
+        if compress:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
+
+    response = Response(generate(), mimetype='application/x-ndjson')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+""" SQLite storage backend of the models (STORAGE_TYPE=sqlite)
+
+Usage: STORAGE_TYPE=sqlite python3 -m models.sqlite_store User [...]
+imports the JSON stores of the given classes into the database
+"""
+from typing import TypeVar, Iterable, Iterator, List
+import importlib
+import json
+import re
+import sqlite3
+import sys
+import threading
+
+
+class SQLiteStore():
+    """ One table per class: the ID, one column per attribute listed in
+    __indexes__ (with an SQL index) and the JSON of the object
+
+    The database is in WAL mode so readers don't block the writer, and
+    every thread gets its own connection. Objects are built from their
+    row on each access, nothing is kept in memory.
+    """
+
+    def __init__(self, db_path: str):
+        """ Initialize a store over the database file db_path
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        self._tables = set()
+        self._mutex = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        """ Connection of the current thread
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def table(self, cls) -> str:
+        """ Quoted table name of cls, created (or completed with the
+        columns of new indexed attributes) on first use
+        """
+        name = '"{}"'.format(cls.__name__)
+        if cls.__name__ in self._tables:
+            return name
+        with self._mutex:
+            conn = self.connection()
+            conn.execute("CREATE TABLE IF NOT EXISTS {} ("
+                         "id TEXT PRIMARY KEY, data TEXT NOT NULL)"
+                         .format(name))
+            columns = {row[1] for row in
+                       conn.execute("PRAGMA table_info({})".format(name))}
+            for attribute in cls.__indexes__:
+                if attribute not in columns:
+                    conn.execute('ALTER TABLE {} ADD COLUMN "{}"'
+                                 .format(name, attribute))
+                conn.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" '
+                             'ON {2} ("{1}")'.format(cls.__name__,
+                                                     attribute, name))
+            self._tables.add(cls.__name__)
+        return name
+
+    @staticmethod
+    def _row(obj: TypeVar('Base')) -> tuple:
+        """ Values of the columns of obj: ID, JSON, indexed attributes
+        """
+        values = [obj.id, obj.serialize()]
+        for attribute in obj.__indexes__:
+            values.append(getattr(obj, attribute, None))
+        return tuple(values)
+
+    def save(self, objs: Iterable[TypeVar('Base')]):
+        """ Insert or replace objects of one class, in one transaction
+        """
+        objs = list(objs)
+        if len(objs) == 0:
+            return
+        cls = type(objs[0])
+        columns = ['id', 'data'] + ['"{}"'.format(attribute)
+                                    for attribute in cls.__indexes__]
+        sql = "INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(
+            self.table(cls), ', '.join(columns),
+            ', '.join('?' * len(columns)))
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(sql, (self._row(obj) for obj in objs))
+
+    def remove(self, cls, *obj_ids: str):
+        """ Delete objects by ID, in one transaction
+        """
+        sql = "DELETE FROM {} WHERE id = ?".format(self.table(cls))
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(sql, ((obj_id,) for obj_id in obj_ids))
+
+    def get(self, cls, obj_id: str) -> TypeVar('Base'):
+        """ Object by ID, None if there is none
+        """
+        row = self.connection().execute(
+            "SELECT data FROM {} WHERE id = ?".format(self.table(cls)),
+            (obj_id,)).fetchone()
+        return None if row is None else cls(**json.loads(row[0]))
+
+    def _where(self, cls, attributes: dict) -> tuple:
+        """ SQL condition and parameters for the attributes stored in a
+        column, and the attributes left to compare on the objects
+        """
+        conditions, params, rest = [], [], {}
+        for k, v in attributes.items():
+            if (k == 'id' or k in cls.__indexes__) and \
+                    (v is None or type(v) in (str, int, float)):
+                if v is None:
+                    conditions.append('"{}" IS NULL'.format(k))
+                else:
+                    conditions.append('"{}" = ?'.format(k))
+                    params.append(v)
+            else:
+                rest[k] = v
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return where, params, rest
+
+    def search(self, cls, attributes: dict = None, order_by: str = None,
+               limit: int = None) -> Iterator[TypeVar('Base')]:
+        """ Yield the objects with matching attributes: attributes with a
+        column are filtered in SQL, the others on the objects built
+
+        order_by is an attribute name, prefixed with '-' for descending
+        order; attributes without a column are sorted on their JSON value
+        """
+        where, params, rest = self._where(cls, attributes or {})
+        order = 'rowid'
+        if order_by is not None:
+            attribute = order_by.lstrip('-')
+            if not attribute.isidentifier():
+                raise ValueError("invalid attribute: {}".format(order_by))
+            if attribute == 'id' or attribute in cls.__indexes__:
+                order = '"{}"'.format(attribute)
+            else:
+                order = "json_extract(data, '$.{}')".format(attribute)
+            if order_by.startswith('-'):
+                order += ' DESC'
+        sql = "SELECT data FROM {}{} ORDER BY {}".format(
+            self.table(cls), where, order)
+        if limit is not None and len(rest) == 0:
+            sql += " LIMIT {:d}".format(limit)
+        found = 0
+        for row in self.connection().execute(sql, params):
+            if limit is not None and found >= limit:
+                return
+            obj = cls(**json.loads(row[0]))
+            if all(getattr(obj, k) == v for k, v in rest.items()):
+                found += 1
+                yield obj
+
+    def count(self, cls, attributes: dict = None) -> int:
+        """ Number of objects with matching attributes
+        """
+        where, params, rest = self._where(cls, attributes or {})
+        if len(rest) > 0:
+            return sum(1 for _ in self.search(cls, attributes))
+        return self.connection().execute(
+            "SELECT COUNT(*) FROM {}{}".format(self.table(cls), where),
+            params).fetchone()[0]
+
+    def page(self, cls, after: str = None,
+             limit: int = 100) -> List[TypeVar('Base')]:
+        """ Up to limit objects by increasing ID, starting after the ID
+        after
+        """
+        sql = "SELECT data FROM {} WHERE id > ? ORDER BY id LIMIT ?".format(
+            self.table(cls))
+        rows = self.connection().execute(sql, (after or '', limit))
+        return [cls(**json.loads(row[0])) for row in rows]
+
+
+def import_json(cls) -> int:
+    """ Copy the JSON store of cls (snapshot and journal) into the SQLite
+    store, return the number of objects imported
+    """
+    from models.base import DATA, INDEXES, _store
+    store = _store()
+    if store is None:
+        raise ValueError("STORAGE_TYPE must be sqlite")
+    s_class = cls.__name__
+    DATA[s_class] = {}
+    INDEXES[s_class] = {}
+    cls._load_eager()
+    objs = list(DATA[s_class].values())
+    store.save(objs)
+    DATA[s_class] = {}
+    INDEXES[s_class] = {}
+    return len(objs)
+
+
+def main(argv: List[str] = None):
+    """ Import the JSON stores of the classes named in argv
+    """
+    for name in argv if argv is not None else sys.argv[1:]:
+        module = re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
+        cls = getattr(importlib.import_module('models.' + module), name)
+        print("{}: {} objects imported".format(name, import_json(cls)))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,12 @@ from api.v1.views import app_views
 from flask import Flask, jsonify, abort, request
 from flask_cors import (CORS, cross_origin)
 from api.v1.auth.auth import Auth
+from models.base import refresh
 from api.v1.auth.basic_auth import BasicAuth
 from api.v1.auth.session_auth import SessionAuth
 from api.v1.auth.session_exp_auth import SessionExpAuth
 from api.v1.auth.session_db_auth import SessionDBAuth
+from api.v1.auth.session_signed_auth import SessionSignedAuth
 import os
 
 
@@ -29,6 +31,8 @@ if auth_type == 'session_exp_auth':
     auth = SessionExpAuth()
 if auth_type == 'session_db_auth':
     auth = SessionDBAuth()
+if auth_type == 'session_signed_auth':
+    auth = SessionSignedAuth()
 
 
 @app.errorhandler(404)
@@ -53,6 +57,7 @@ def forbidden(error) -> str:
 @app.before_request
 def before_request():
     """Filter each request"""
+    refresh()
     if auth is None:
         return
     paths = [
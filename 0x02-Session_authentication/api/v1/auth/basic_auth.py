@@ -83,12 +83,10 @@ class BasicAuth(Auth):
         if user_pwd is None or not isinstance(user_pwd, str):
             return None
         try:
-            users = User.search({'email': user_email})
-            if not users or not len(users):
+            user = User.query(email=user_email).first()
+            if user is None or not user.is_valid_password(user_pwd):
                 return None
-            if not users[0].is_valid_password(user_pwd):
-                return None
-            return users[0]
+            return user
         except Exception:
             return None
 
@@ -1,14 +1,25 @@
 #!/usr/bin/env python3
 """class to manage the Session authentication"""
 from api.v1.auth.auth import Auth
+from api.v1.auth.session_backends import session_backend
 from uuid import uuid4
 from models.user import User
+from os import getenv
 
 
 class SessionAuth(Auth):
     """class to manage the Session authentication"""
     user_id_by_session_id: dict = {}
 
+    def __init__(self):
+        """Initialize the class
+
+        The sessions stay in the class dictionary unless SESSION_BACKEND
+        selects a backend shared by the workers (see session_backends)
+        """
+        if getenv('SESSION_BACKEND', 'memory') != 'memory':
+            self.user_id_by_session_id = session_backend()
+
     def create_session(self, user_id: str = None) -> str:
         """Creates a Session ID for a user_id
 
@@ -57,5 +68,5 @@ class SessionAuth(Auth):
         user_id = self.user_id_for_session_id(session_cookie)
         if user_id is None:
             return False
-        del self.user_id_by_session_id[session_cookie]
+        self.user_id_by_session_id.pop(session_cookie, None)
         return True
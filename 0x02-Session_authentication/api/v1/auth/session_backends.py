@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""Session backends shared by the workers of a host or a cluster
+
+SESSION_BACKEND selects where SessionAuth and its subclasses keep the
+sessions:
+- memory (default): in the process (see SessionStore)
+- sqlite: in the SQLite database SESSION_SQLITE_PATH, in WAL mode
+- kv: in the key-value service at SESSION_KV_URL (redis://... through
+  the redis package, memory:// for an in-process fake)
+
+Every backend is a mutable mapping session ID -> session, the sessions
+being a user ID or a dictionary (datetimes included).
+"""
+from collections.abc import MutableMapping
+from datetime import datetime
+from os import getenv
+import json
+import sqlite3
+import threading
+import time
+
+SQLITE_PATH = ".db_sessions.sqlite3"
+SWEEP_EVERY = 1000
+SWEEP_BATCH = 1000
+KV_PREFIX = "session:"
+_fake_kv = None
+
+
+def _dumps(value) -> str:
+    """JSON text of a session, datetimes included"""
+    def default(obj):
+        if isinstance(obj, datetime):
+            return {'$datetime': obj.isoformat()}
+        raise TypeError("{} is not serializable".format(type(obj)))
+    return json.dumps(value, default=default)
+
+
+def _loads(text):
+    """Session of a JSON text written by _dumps"""
+    def object_hook(obj):
+        if len(obj) == 1 and '$datetime' in obj:
+            return datetime.fromisoformat(obj['$datetime'])
+        return obj
+    return json.loads(text, object_hook=object_hook)
+
+
+def session_backend(ttl: float = None, max_size: int = None):
+    """Session container selected by SESSION_BACKEND
+
+    Args:
+        ttl (float): Lifetime of a session in seconds, None for no limit
+        max_size (int): Maximum number of sessions kept by the memory
+            backend, None for no limit; the shared backends ignore it
+
+    Returns:
+        MutableMapping: The backend
+    """
+    backend = getenv('SESSION_BACKEND', 'memory')
+    if backend == 'sqlite':
+        return SQLiteSessionBackend(
+            getenv('SESSION_SQLITE_PATH', SQLITE_PATH), ttl)
+    if backend == 'kv':
+        return KVSessionBackend(
+            kv_client(getenv('SESSION_KV_URL', 'memory://')), ttl)
+    if backend != 'memory':
+        raise ValueError("unknown SESSION_BACKEND: {}".format(backend))
+    from api.v1.auth.session_store import SessionStore
+    return SessionStore(ttl, max_size)
+
+
+class SQLiteSessionBackend(MutableMapping):
+    """Sessions in an SQLite table, shared by the processes of the host
+
+    The database is in WAL mode (readers don't wait for the writer) and
+    every thread has its own connection. Expired sessions are never
+    returned and are deleted SWEEP_BATCH at a time every SWEEP_EVERY
+    writes.
+    """
+
+    def __init__(self, db_path: str, ttl: float = None):
+        """Initialize the backend over the database file db_path"""
+        self.db_path = db_path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        conn = self.connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                     "session_id TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                     "expires REAL) WITHOUT ROWID")
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires "
+                     "ON sessions (expires)")
+
+    def connection(self) -> sqlite3.Connection:
+        """Connection of the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def __getitem__(self, session_id: str):
+        """Session of a session ID, KeyError if missing or expired"""
+        row = self.connection().execute(
+            "SELECT value FROM sessions WHERE session_id = ? AND "
+            "(expires IS NULL OR expires > ?)",
+            (session_id, time.time())).fetchone()
+        if row is None:
+            raise KeyError(session_id)
+        return _loads(row[0])
+
+    def __setitem__(self, session_id: str, value):
+        """Store a session, its lifetime starting now"""
+        expires = None if self.ttl is None else time.time() + self.ttl
+        self.connection().execute(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+            (session_id, _dumps(value), expires))
+        self._writes += 1
+        if self._writes % SWEEP_EVERY == 0:
+            self.sweep()
+
+    def __delitem__(self, session_id: str):
+        """Delete a session"""
+        cursor = self.connection().execute(
+            "DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        if cursor.rowcount == 0:
+            raise KeyError(session_id)
+
+    def pop(self, session_id: str, *default):
+        """Remove a session and return it, in one transaction"""
+        conn = self.connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = self[session_id]
+            except KeyError:
+                if default:
+                    return default[0]
+                raise
+            conn.execute("DELETE FROM sessions WHERE session_id = ?",
+                         (session_id,))
+        return value
+
+    def __iter__(self):
+        """Iterate over the IDs of the live sessions"""
+        rows = self.connection().execute(
+            "SELECT session_id FROM sessions WHERE "
+            "expires IS NULL OR expires > ?", (time.time(),)).fetchall()
+        return (row[0] for row in rows)
+
+    def __len__(self) -> int:
+        """Number of live sessions"""
+        return self.connection().execute(
+            "SELECT COUNT(*) FROM sessions WHERE "
+            "expires IS NULL OR expires > ?", (time.time(),)).fetchone()[0]
+
+    def sweep(self) -> int:
+        """Delete the expired sessions, SWEEP_BATCH per transaction
+
+        Returns:
+            int: The number of sessions deleted
+        """
+        removed = 0
+        while True:
+            cursor = self.connection().execute(
+                "DELETE FROM sessions WHERE session_id IN ("
+                "SELECT session_id FROM sessions WHERE expires <= ? "
+                "LIMIT ?)", (time.time(), SWEEP_BATCH))
+            removed += cursor.rowcount
+            if cursor.rowcount < SWEEP_BATCH:
+                return removed
+
+
+class FakeKVClient():
+    """In-process stand-in of a redis client: get, set (with ex),
+    delete and scan_iter, with the expiry of the keys"""
+
+    def __init__(self):
+        """Initialize an empty store"""
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: str):
+        """Value of a key, None if missing or expired"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry[0]
+
+    def get(self, key: str) -> bytes:
+        """Value of a key"""
+        with self._lock:
+            return self._live(key)
+
+    def set(self, key: str, value, ex: float = None) -> bool:
+        """Set a key, expiring in ex seconds"""
+        if isinstance(value, str):
+            value = value.encode()
+        expires = None if ex is None else time.monotonic() + ex
+        with self._lock:
+            self._data[key] = (value, expires)
+        return True
+
+    def delete(self, *keys: str) -> int:
+        """Delete keys, return how many existed"""
+        with self._lock:
+            found = [key for key in keys if self._live(key) is not None]
+            for key in found:
+                del self._data[key]
+        return len(found)
+
+    def scan_iter(self, match: str = '*'):
+        """Iterate over the live keys starting with the prefix of match"""
+        prefix = match.rstrip('*')
+        with self._lock:
+            keys = [key for key in list(self._data)
+                    if key.startswith(prefix) and
+                    self._live(key) is not None]
+        return iter(keys)
+
+
+def kv_client(url: str):
+    """Client of the key-value service at url: the process-wide
+    FakeKVClient for memory://, a redis client otherwise"""
+    global _fake_kv
+    if url.startswith('memory://'):
+        if _fake_kv is None:
+            _fake_kv = FakeKVClient()
+        return _fake_kv
+    import redis
+    return redis.Redis.from_url(url)
+
+
+class KVSessionBackend(MutableMapping):
+    """Sessions in a key-value service, shared by every worker that
+    uses it; the service expires the keys"""
+
+    def __init__(self, client, ttl: float = None):
+        """Initialize the backend over a redis-like client"""
+        self.client = client
+        self.ttl = ttl
+
+    def __getitem__(self, session_id: str):
+        """Session of a session ID, KeyError if missing or expired"""
+        value = self.client.get(KV_PREFIX + session_id)
+        if value is None:
+            raise KeyError(session_id)
+        return _loads(value)
+
+    def __setitem__(self, session_id: str, value):
+        """Store a session, its lifetime starting now"""
+        ex = None if self.ttl is None else max(int(self.ttl), 1)
+        self.client.set(KV_PREFIX + session_id, _dumps(value), ex=ex)
+
+    def __delitem__(self, session_id: str):
+        """Delete a session"""
+        if self.client.delete(KV_PREFIX + session_id) == 0:
+            raise KeyError(session_id)
+
+    def pop(self, session_id: str, *default):
+        """Remove a session and return it"""
+        try:
+            value = self[session_id]
+            del self[session_id]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        return value
+
+    def __iter__(self):
+        """Iterate over the IDs of the sessions"""
+        for key in self.client.scan_iter(match=KV_PREFIX + '*'):
+            if isinstance(key, bytes):
+                key = key.decode()
+            yield key[len(KV_PREFIX):]
+
+    def __len__(self) -> int:
+        """Number of sessions (scans the keys)"""
+        return sum(1 for _ in self)
@@ -1,37 +1,125 @@
 #!/usr/bin/env python3
-"""User session model"""
+"""User session model
+
+Usage: SESSION_DURATION=<seconds> python3 -m api.v1.auth.session_db_auth
+drops the expired sessions from the store
+"""
 from api.v1.auth.session_exp_auth import SessionExpAuth
 from models.user_session import UserSession
 from datetime import datetime, timedelta
+from os import getenv, path
+from typing import List
+from uuid import uuid4
+import argparse
+import logging
+import threading
+import time
+
+_compactor = None
+
+
+def _store_size() -> int:
+    """Size in bytes of the UserSession files"""
+    size = 0
+    for file_path in ('.db_UserSession.json', '.db_UserSession.journal'):
+        if path.exists(file_path):
+            size += path.getsize(file_path)
+    return size
+
+
+def compact_sessions(duration: int = None) -> dict:
+    """Remove the sessions older than duration in one pass; the store
+    is rewritten atomically once, under the file lock of UserSession
+    and after catching up with the other workers' writes (with
+    STORAGE_TYPE=sqlite the rows are deleted in one transaction and no
+    bytes are reported, SQLite reuses the freed pages)
+
+    Args:
+        duration (int): Session lifetime in seconds, SESSION_DURATION
+            by default; nothing expires when it is not positive
+
+    Returns:
+        dict: Number of sessions reclaimed and bytes saved
+    """
+    if duration is None:
+        duration = int(getenv('SESSION_DURATION', '0'))
+    if duration <= 0:
+        return {'reclaimed': 0, 'bytes_saved': 0}
+    UserSession.refresh()
+    size = _store_size()
+    cutoff = datetime.utcnow() - timedelta(seconds=duration)
+    reclaimed = UserSession.remove_many(
+        user_session for user_session in UserSession.query()
+        if user_session.created_at < cutoff)
+    return {'reclaimed': reclaimed,
+            'bytes_saved': max(size - _store_size(), 0)}
+
+
+def _compact_loop(interval: int):
+    """Compact the sessions every interval seconds; a failed pass is
+    logged and the next one runs on schedule"""
+    while True:
+        time.sleep(interval)
+        try:
+            compact_sessions()
+        except Exception:
+            logging.getLogger(__name__).exception(
+                "session compaction failed")
 
 
 class SessionDBAuth(SessionExpAuth):
     """Authentication class"""
+    def __init__(self):
+        """Initialize the class
+
+        With SESSION_COMPACT_INTERVAL set, the expired sessions are
+        compacted every SESSION_COMPACT_INTERVAL seconds in a
+        background thread
+        """
+        global _compactor
+        super().__init__()
+        interval = int(getenv('SESSION_COMPACT_INTERVAL', '0'))
+        if interval > 0 and _compactor is None:
+            _compactor = threading.Thread(target=_compact_loop,
+                                          args=(interval,), daemon=True)
+            _compactor.start()
+
     def create_session(self, user_id=None):
-        """Overload the create session method"""
-        session_id = super().create_session(user_id)
-        if not session_id:
+        """Overload the create session method
+
+        The session is only stored as a UserSession, never in the
+        session container of SessionAuth
+        """
+        if user_id is None or not isinstance(user_id, str):
             return None
+        session_id = str(uuid4())
         arg = {"user_id": user_id, "session_id": session_id}
         user_session = UserSession(**arg)
         user_session.save()
-        user_session.save_to_file()
         return session_id
 
     def user_id_for_session_id(self, session_id=None):
         """Overload user id for session id"""
-        if session_id is None:
+        user_session = self.user_session_for_session_id(session_id)
+        if user_session is None:
             return None
+        return user_session.user_id
 
-        UserSession.load_from_file()
-        user_session = UserSession.search({
-            'session_id': session_id
-        })
+    def user_session_for_session_id(self, session_id=None):
+        """Live UserSession of a session ID
 
-        if not user_session:
+        The UserSession objects stay in memory and are only reloaded when
+        .db_UserSession.json changed; the session ID is looked up in the
+        session_id index, so a validation doesn't depend on the number
+        of sessions
+        """
+        if session_id is None:
             return None
 
-        user_session = user_session[0]
+        UserSession.refresh()
+        user_session = UserSession.query(session_id=session_id).first()
+        if user_session is None:
+            return None
 
         expired_time = user_session.created_at + \
             timedelta(seconds=self.session_duration)
@@ -39,7 +127,7 @@ class SessionDBAuth(SessionExpAuth):
         if expired_time < datetime.utcnow():
             return None
 
-        return user_session.user_id
+        return user_session
 
     def destroy_session(self, request=None):
         """Overload destroy session"""
@@ -48,12 +136,24 @@ class SessionDBAuth(SessionExpAuth):
         session_id = self.session_cookie(request)
         if not session_id:
             return False
-        user_id = self.user_id_for_session_id(session_id)
-        if not user_id:
-            return False
-        user_session = UserSession.search({"session_id": session_id})
-        if not user_session:
+        user_session = self.user_session_for_session_id(session_id)
+        if user_session is None:
             return False
-        user_session[0].remove()
-        UserSession.save_to_file()
+        user_session.remove()
         return True
+
+
+def main(argv: List[str] = None):
+    """Drop the expired sessions from the UserSession store"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--duration', type=int, default=None,
+                        help='session lifetime in seconds '
+                             '(default: SESSION_DURATION)')
+    args = parser.parse_args(argv)
+    result = compact_sessions(args.duration)
+    print("{} sessions reclaimed, {} bytes saved".format(
+        result['reclaimed'], result['bytes_saved']))
+
+
+if __name__ == "__main__":
+    main()
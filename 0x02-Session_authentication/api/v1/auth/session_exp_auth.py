@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 """class SessionExpAuth"""
 from api.v1.auth.session_auth import SessionAuth
+from api.v1.auth.session_backends import session_backend
 from os import getenv
 from datetime import datetime, timedelta
 
@@ -8,8 +9,18 @@ from datetime import datetime, timedelta
 class SessionExpAuth(SessionAuth):
     """class SessionExpAuth"""
     def __init__(self):
-        """Initialize the class"""
+        """Initialize the class
+
+        The sessions are kept in the SESSION_BACKEND backend, by default
+        a SessionStore, that drops them once SESSION_DURATION is over
+        and keeps at most SESSION_MAX_COUNT of them (the least recently
+        used go first) when it is set
+        """
         self.session_duration = int(getenv('SESSION_DURATION', '0'))
+        max_count = int(getenv('SESSION_MAX_COUNT', '0'))
+        self.user_id_by_session_id = session_backend(
+            self.session_duration if self.session_duration > 0 else None,
+            max_count if max_count > 0 else None)
 
     def create_session(self, user_id=None):
         """Overload the create session method"""
@@ -26,10 +37,9 @@ class SessionExpAuth(SessionAuth):
         """Overload the user id for session id method"""
         if not session_id:
             return None
-        session_dict = super().user_id_by_session_id.get(session_id)
+        session_dict = self.user_id_by_session_id.get(session_id)
         if not session_dict:
             return None
-        session_dict = self.user_id_by_session_id[session_id]
         if self.session_duration <= 0:
             return session_dict.get('user_id')
         created_at = session_dict.get('created_at')
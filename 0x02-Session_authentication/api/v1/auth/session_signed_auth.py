@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""class SessionSignedAuth"""
+from api.v1.auth.session_exp_auth import SessionExpAuth
+from api.v1.auth.session_backends import session_backend
+from os import getenv
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+REVOCATION_MAX = 10000
+NOT_BEFORE = '$not_before:'
+
+
+def _b64encode(data: bytes) -> str:
+    """URL-safe base64 without padding"""
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(text: str) -> bytes:
+    """Inverse of _b64encode"""
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class SessionSignedAuth(SessionExpAuth):
+    """Stateless sessions: the session ID is a token carrying the user
+    ID, the issue time and the expiry, signed with HMAC-SHA256
+
+    SESSION_SIGNING_KEYS is a comma separated list of keys: the first
+    one signs, all of them verify, so a key is rotated by putting the
+    new key first and dropping the old one once its tokens expired.
+    Without keys a random key is drawn, valid for this process only.
+
+    Logged out tokens are kept until they expire in a revocation list
+    of SESSION_REVOCATION_MAX tokens (0 disables it), held in the
+    SESSION_BACKEND backend. A revocation is never dropped early: once
+    the list is full, a logout rejects every token of its user issued
+    so far instead (a "not before" time of the user, stored in the
+    list), which logs that user out of all their sessions and nobody
+    else. With the default memory backend the list belongs to the
+    process: a token logged out on one worker stays valid on the other
+    ones, use a shared backend (sqlite, kv) with several workers.
+    """
+
+    def __init__(self):
+        """Initialize the class"""
+        self.session_duration = int(getenv('SESSION_DURATION', '0'))
+        keys = getenv('SESSION_SIGNING_KEYS', '')
+        self.keys = [key.encode() for key in keys.split(',') if key]
+        if len(self.keys) == 0:
+            self.keys = [os.urandom(32)]
+        size = int(getenv('SESSION_REVOCATION_MAX', str(REVOCATION_MAX)))
+        self.revocation_max = size
+        self.revoked = None
+        if size > 0:
+            self.revoked = session_backend(
+                self.session_duration if self.session_duration > 0
+                else None)
+
+    @staticmethod
+    def _sign(key: bytes, payload: str) -> str:
+        """Signature of a payload"""
+        return _b64encode(hmac.new(key, payload.encode(),
+                                   hashlib.sha256).digest())
+
+    def create_session(self, user_id: str = None) -> str:
+        """Signed token of a user ID, nothing is stored
+
+        Args:
+            user_id (str): The User ID. Defaults to None.
+
+        Returns:
+            str: The token, used as session ID
+        """
+        if user_id is None or not isinstance(user_id, str):
+            return None
+        expires = None
+        if self.session_duration > 0:
+            expires = int(time.time()) + self.session_duration
+        payload = _b64encode(json.dumps(
+            {'u': user_id, 'i': time.time(), 'e': expires,
+             'n': _b64encode(os.urandom(8))},
+            separators=(',', ':')).encode())
+        return "{}.{}".format(payload, self._sign(self.keys[0], payload))
+
+    def user_id_for_session_id(self, session_id: str = None) -> str:
+        """User ID of a valid, unexpired and not revoked token
+
+        Args:
+            session_id (str): The token. Defaults to None.
+
+        Returns:
+            str: The User ID
+        """
+        if session_id is None or not isinstance(session_id, str) or \
+                not session_id.isascii():
+            return None
+        payload, _, signature = session_id.partition('.')
+        if not any(hmac.compare_digest(self._sign(key, payload), signature)
+                   for key in self.keys):
+            return None
+        try:
+            data = json.loads(_b64decode(payload))
+        except ValueError:
+            return None
+        if data.get('e') is not None and data['e'] <= time.time():
+            return None
+        if self.revoked is not None:
+            if signature in self.revoked:
+                return None
+            not_before = self.revoked.get(NOT_BEFORE + str(data.get('u')))
+            if not_before is not None and data.get('i', 0) <= not_before:
+                return None
+        return data.get('u')
+
+    def destroy_session(self, request=None):
+        """Revoke the token of the request until it expires, or every
+        token of its user issued so far when the revocation list is
+        full"""
+        if not request:
+            return False
+        session_id = self.session_cookie(request)
+        user_id = self.user_id_for_session_id(session_id)
+        if user_id is None:
+            return False
+        if self.revoked is None:
+            return False
+        if len(self.revoked) < self.revocation_max:
+            self.revoked[session_id.partition('.')[2]] = True
+        else:
+            self.revoked[NOT_BEFORE + user_id] = time.time()
+        return True
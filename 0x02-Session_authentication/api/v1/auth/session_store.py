@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""Expiring in-memory session container"""
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import heapq
+import threading
+import time
+import weakref
+
+SWEEP_INTERVAL = 60
+SWEEP_BATCH = 1000
+
+
+def _sweep_loop(ref: weakref.ref, interval: float):
+    """Sweep the store every interval seconds while it exists"""
+    while True:
+        time.sleep(interval)
+        store = ref()
+        if store is None:
+            return
+        store.sweep()
+        del store
+
+
+class SessionStore(MutableMapping):
+    """Session ID -> session mapping whose entries expire ttl seconds
+    after they are set
+
+    Lookups are O(1) and never return an expired entry. Expiry times
+    are kept in a min-heap that a background thread sweeps every
+    sweep_interval seconds, SWEEP_BATCH entries per lock hold. With
+    max_size the least recently used sessions are evicted past that
+    size.
+
+    Counters: live (unexpired entries), expired (removed by the TTL)
+    and evicted (removed by the size cap).
+    """
+
+    def __init__(self, ttl: float = None, max_size: int = None,
+                 sweep_interval: float = SWEEP_INTERVAL):
+        """Initialize an empty store
+
+        Args:
+            ttl (float): Lifetime of an entry in seconds, None to keep
+                the entries until they are deleted
+            max_size (int): Maximum number of entries, None for no limit
+            sweep_interval (float): Seconds between two sweeps
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sweep_interval = sweep_interval
+        self.expired = 0
+        self.evicted = 0
+        self._data = OrderedDict()
+        self._heap = []
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def __getitem__(self, session_id: str):
+        """Session of a session ID, KeyError if missing or expired"""
+        with self._lock:
+            value, expires = self._data[session_id]
+            if expires is not None and expires <= time.monotonic():
+                del self._data[session_id]
+                self.expired += 1
+                raise KeyError(session_id)
+            if self.max_size is not None:
+                self._data.move_to_end(session_id)
+            return value
+
+    def __setitem__(self, session_id: str, value):
+        """Store a session, its lifetime starting now"""
+        expires = None
+        if self.ttl is not None:
+            expires = time.monotonic() + self.ttl
+        with self._lock:
+            self._data[session_id] = (value, expires)
+            self._data.move_to_end(session_id)
+            if expires is not None:
+                heapq.heappush(self._heap, (expires, session_id))
+                if len(self._heap) > 2 * len(self._data) + SWEEP_BATCH:
+                    self._heap = [(e, k) for k, (_, e) in self._data.items()]
+                    heapq.heapify(self._heap)
+            if self.max_size is not None:
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+                    self.evicted += 1
+        if expires is not None and self._sweeper is None:
+            self._start_sweeper()
+
+    def __delitem__(self, session_id: str):
+        """Delete a session"""
+        with self._lock:
+            del self._data[session_id]
+
+    def pop(self, session_id: str, *default):
+        """Remove a session and return it, in one step"""
+        with self._lock:
+            entry = self._data.pop(session_id, None)
+            if entry is not None and entry[1] is not None and \
+                    entry[1] <= time.monotonic():
+                self.expired += 1
+                entry = None
+        if entry is None:
+            if default:
+                return default[0]
+            raise KeyError(session_id)
+        return entry[0]
+
+    def __iter__(self):
+        """Iterate over a snapshot of the session IDs"""
+        with self._lock:
+            return iter(list(self._data))
+
+    def __len__(self) -> int:
+        """Number of sessions, including expired ones not swept yet"""
+        return len(self._data)
+
+    @property
+    def live(self) -> int:
+        """Number of unexpired sessions, unlike len which counts the
+        expired ones not swept yet (O(n))"""
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for _, expires in self._data.values()
+                       if expires is None or expires > now)
+
+    def _start_sweeper(self):
+        """Start the background sweeper once"""
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(
+                target=_sweep_loop,
+                args=(weakref.ref(self), self.sweep_interval), daemon=True)
+        self._sweeper.start()
+
+    def sweep(self) -> int:
+        """Remove the expired sessions, SWEEP_BATCH at a time
+
+        Returns:
+            int: The number of sessions removed
+        """
+        removed = 0
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                for _ in range(SWEEP_BATCH):
+                    if not self._heap or self._heap[0][0] > now:
+                        return removed
+                    expires, session_id = heapq.heappop(self._heap)
+                    entry = self._data.get(session_id)
+                    if entry is not None and entry[1] == expires:
+                        del self._data[session_id]
+                        self.expired += 1
+                        removed += 1
@@ -19,19 +19,18 @@ def session_login():
     if not password or not len(password):
         return jsonify({"error": "password missing"}), 400
 
-    user = User.search({'email': email})
-    if not user or not len(user):
+    user = User.query(email=email).first()
+    if user is None:
         return jsonify({"error": "no user found for this email"}), 404
 
-    for i in user:
-        if not i.is_valid_password(password):
-            return jsonify({"error": "wrong password"}), 401
+    if not user.is_valid_password(password):
+        return jsonify({"error": "wrong password"}), 401
 
-        from api.v1.app import auth
-        session_id = auth.create_session(i.id)
-        response = jsonify(i.to_json())
-        session_name = getenv('SESSION_NAME')
-        response.set_cookie(session_name, session_id)
+    from api.v1.app import auth
+    session_id = auth.create_session(user.id)
+    response = jsonify(user.to_json())
+    session_name = getenv('SESSION_NAME')
+    response.set_cookie(session_name, session_id)
     return response
 
 
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+""" Memory used by UserSession objects, measured with tracemalloc once
+built, after a save_to_file and after a listing (what a worker holds)
+
+Usage: [MODELS_COMPACT=1] [MODELS_JSON_CACHE=1] ./bench_models_memory.py
+    [count]
+"""
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+import uuid
+from models.base import DATA
+from models.user_session import UserSession
+
+
+def report(label: str, count: int):
+    """ Print the memory traced so far
+    """
+    current, _ = tracemalloc.get_traced_memory()
+    print("{} sessions {}: {:.1f} MB ({:.0f} bytes each)".format(
+        count, label, current / (1 << 20), current / count))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    os.chdir(tempfile.mkdtemp())
+    UserSession.load_from_file()
+    user_ids = [json.dumps(str(uuid.uuid4())) for _ in range(1000)]
+    tracemalloc.start()
+    sessions = DATA['UserSession']
+    for i in range(count):
+        # user_id decoded for each session, as when loaded from file
+        user_session = UserSession(user_id=json.loads(user_ids[i % 1000]),
+                                   session_id=str(uuid.uuid4()))
+        sessions[user_session.id] = user_session
+    report("built", count)
+    UserSession.save_to_file()
+    report("after save_to_file", count)
+    for user_session in UserSession.all():
+        user_session.to_json()
+    report("after listing", count)
+    tracemalloc.stop()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+""" Benchmark of SessionDBAuth.user_id_for_session_id latency as the
+number of stored sessions grows, against a full reload per request
+
+Usage: SESSION_DURATION=3600 ./bench_session_db_auth.py [max sessions]
+"""
+import os
+import sys
+import tempfile
+import time
+from api.v1.auth.session_db_auth import SessionDBAuth
+from models.base import DATA
+from models.user_session import UserSession
+
+
+def fill(count: int) -> list:
+    """ Store count sessions and return their session IDs
+    """
+    UserSession.load_from_file()
+    session_ids = []
+    for i in range(count):
+        user_session = UserSession(user_id="user{}".format(i),
+                                   session_id="session{}".format(i))
+        DATA['UserSession'][user_session.id] = user_session
+        session_ids.append(user_session.session_id)
+    UserSession.save_to_file()
+    UserSession.load_from_file()
+    return session_ids
+
+
+def latencies(func, session_ids: list, calls: int) -> list:
+    """ Sorted latencies in microseconds of calls lookups
+    """
+    result = []
+    for i in range(calls):
+        session_id = session_ids[i * 7919 % len(session_ids)]
+        start = time.perf_counter()
+        assert func(session_id) is not None
+        result.append((time.perf_counter() - start) * 1e6)
+    return sorted(result)
+
+
+def reload_and_search(session_id: str) -> str:
+    """ Previous implementation: reload the file, then search
+    """
+    UserSession.load_from_file()
+    return UserSession.search({'session_id': session_id})[0].user_id
+
+
+if __name__ == "__main__":
+    maximum = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    os.environ.setdefault('SESSION_DURATION', '3600')
+    os.chdir(tempfile.mkdtemp())
+    auth = SessionDBAuth()
+    size = 1000
+    while size <= maximum:
+        session_ids = fill(size)
+        new = latencies(auth.user_id_for_session_id, session_ids, 10000)
+        old = latencies(reload_and_search, session_ids,
+                        max(3, 100000 // size))
+        print("{:>8} sessions: reload p50 {:>10.0f} us p99 {:>10.0f} us | "
+              "cached p50 {:>5.1f} us p99 {:>5.1f} us".format(
+                  size, old[len(old) // 2], old[len(old) * 99 // 100],
+                  new[len(new) // 2], new[len(new) * 99 // 100]))
+        size *= 10
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+""" Benchmark of User.save() writes/sec as the store grows
+
+Usage: STORAGE_TYPE=journal ./bench_storage.py [max objects]
+"""
+import os
+import sys
+import tempfile
+import time
+from models.base import DATA
+from models.user import User
+
+
+def fill(count: int):
+    """ Put count users in the store and write the snapshot
+    """
+    User.load_from_file()
+    for i in range(count):
+        user = User(email="user{}@example.com".format(i))
+        DATA['User'][user.id] = user
+    User.save_to_file()
+
+
+if __name__ == "__main__":
+    maximum = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    os.chdir(tempfile.mkdtemp())
+    size = 1000
+    while size <= maximum:
+        fill(size)
+        writes = 1000 if os.getenv('STORAGE_TYPE') == 'journal' else 20
+        start = time.perf_counter()
+        for i in range(writes):
+            user = User(email="new{}@example.com".format(i))
+            user.save()
+        elapsed = time.perf_counter() - start
+        print("{:>8} objects: {:>9.1f} writes/s".format(
+            size, writes / elapsed))
+        size *= 10
@@ -1,27 +1,605 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from collections import OrderedDict
+from contextlib import contextmanager
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+from typing import TypeVar, List, Iterable, Iterator
+from os import getenv, path
+import atexit
+import heapq
+import itertools
 import json
+import logging
+import os
+import threading
 import uuid
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+EPOCH = datetime(1970, 1, 1)
+COMPACT = getenv('MODELS_COMPACT', '0') == '1'
+JSON_CACHE = getenv('MODELS_JSON_CACHE', '0') == '1'
+JOURNAL_MAX_BYTES = 16 << 20
+FLUSH_INTERVAL_MS = 100
+FLUSH_MAX_MUTATIONS = 1000
+LAZY_CACHE_SIZE = 10000
+QUERY_CHUNK = 100
+SQLITE_PATH = ".db.sqlite3"
 DATA = {}
+INDEXES = {}
+DIRTY = {}
+LOCKS = {}
+IO_LOCKS = {}
+FILE_LOCKS = {}
+FILE_STATE = {}
+IN_FLIGHT = {}
+_dirty_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_flush_event = threading.Event()
+_flusher = None
+_sqlite = None
+
+
+def _store():
+    """ SQLiteStore of the models with STORAGE_TYPE=sqlite (database
+    file STORAGE_SQLITE_PATH), None with the JSON file backends
+    """
+    global _sqlite
+    if getenv('STORAGE_TYPE', 'file') != 'sqlite':
+        return None
+    if _sqlite is None:
+        from models.sqlite_store import SQLiteStore
+        _sqlite = SQLiteStore(getenv('STORAGE_SQLITE_PATH', SQLITE_PATH))
+    return _sqlite
+
+
+def flush():
+    """ Write the pending mutations of every dirty class, each class
+    file being replaced in one atomic write
+
+    The mutations of a class that fail to be written are queued again,
+    ahead of the newer ones, and the first error is raised once every
+    class was tried.
+    """
+    error = None
+    with _flush_lock:
+        with _dirty_lock:
+            dirty = dict(DIRTY)
+            DIRTY.clear()
+            for cls, records in dirty.items():
+                _hold(cls.__name__, _record_ids(records))
+        for cls, records in dirty.items():
+            try:
+                cls._write(records)
+            except Exception as e:
+                with _dirty_lock:
+                    DIRTY[cls] = records + DIRTY.get(cls, [])
+                error = error or e
+            finally:
+                with _dirty_lock:
+                    _release(cls.__name__, _record_ids(records))
+    if error is not None:
+        raise error
+
+
+def _flush_loop():
+    """ Background flusher: every FLUSH_INTERVAL_MS, or as soon as
+    FLUSH_MAX_MUTATIONS mutations are pending; a failed write is logged
+    and retried on the next round
+    """
+    interval = int(getenv('FLUSH_INTERVAL_MS', str(FLUSH_INTERVAL_MS)))
+    while True:
+        _flush_event.wait(interval / 1000)
+        _flush_event.clear()
+        try:
+            flush()
+        except Exception:
+            logging.getLogger(__name__).exception(
+                "flush failed, the mutations stay pending")
+
+
+def _mark_dirty(cls, record: dict):
+    """ Queue a mutation for the background flusher
+    """
+    global _flusher
+    maximum = int(getenv('FLUSH_MAX_MUTATIONS', str(FLUSH_MAX_MUTATIONS)))
+    with _dirty_lock:
+        DIRTY.setdefault(cls, []).append(record)
+        pending = sum(len(records) for records in DIRTY.values())
+        if _flusher is None:
+            atexit.register(flush)
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_loop, daemon=True)
+            _flusher.start()
+    if pending >= maximum:
+        _flush_event.set()
+
+
+def _record_ids(records: List[dict]) -> List[str]:
+    """ IDs of the objects of journal records
+    """
+    return [r['obj']['id'] if r.get('op') == 'save' else r['id']
+            for r in records]
+
+
+def _hold(s_class: str, ids: Iterable[str]):
+    """ Count a mutation in progress for each object (_dirty_lock held)
+    """
+    counts = IN_FLIGHT.setdefault(s_class, {})
+    for obj_id in ids:
+        counts[obj_id] = counts.get(obj_id, 0) + 1
+
+
+def _release(s_class: str, ids: Iterable[str]):
+    """ Inverse of _hold (_dirty_lock held)
+    """
+    counts = IN_FLIGHT[s_class]
+    for obj_id in ids:
+        counts[obj_id] -= 1
+        if counts[obj_id] == 0:
+            del counts[obj_id]
+
+
+@contextmanager
+def _in_flight(s_class: str, ids: Iterable[str]):
+    """ Mark objects as mutated in memory and not yet on disk: catching
+    up with the files keeps their in-memory state
+    """
+    ids = list(ids)
+    with _dirty_lock:
+        _hold(s_class, ids)
+    try:
+        yield
+    finally:
+        with _dirty_lock:
+            _release(s_class, ids)
+
+
+def _pending_ids(cls) -> set:
+    """ IDs of the objects of cls with mutations not on disk yet
+    """
+    with _dirty_lock:
+        ids = set(IN_FLIGHT.get(cls.__name__, ()))
+        ids.update(_record_ids(DIRTY.get(cls, [])))
+    return ids
+
+
+def refresh():
+    """ Reload in every loaded class what other processes changed in
+    its files (see Base.refresh)
+    """
+    for state in list(FILE_STATE.values()):
+        state['cls'].refresh()
+
+
+def _drop_torn_record(f):
+    """ Cut the record left incomplete at the end of a journal opened
+    for update by an append that crashed, so that the next records start
+    on a line of their own instead of being lost behind it
+    """
+    end = f.seek(0, os.SEEK_END)
+    if end == 0:
+        return
+    f.seek(end - 1)
+    if f.read(1) == b'\n':
+        return
+    offset = end
+    while offset > 0:
+        start = max(offset - 4096, 0)
+        f.seek(start)
+        newline = f.read(offset - start).rfind(b'\n')
+        if newline >= 0:
+            f.truncate(start + newline + 1)
+            return
+        offset = start
+    f.truncate(0)
+
+
+def _signature(file_path: str) -> tuple:
+    """ (inode, mtime, size) of a file, None if it doesn't exist
+    """
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class RWLock():
+    """ Readers-writer lock: any number of readers share it, a writer
+    holds it alone; waiting writers go first and the writing thread may
+    acquire it again (read or write)
+    """
+
+    def __init__(self):
+        """ Initialize an unlocked lock
+        """
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._depth = 0
+        self._waiting = 0
+
+    @contextmanager
+    def read(self):
+        """ Hold the lock as a reader
+        """
+        if self._writer == threading.get_ident():
+            yield
+            return
+        with self._cond:
+            while self._writer is not None or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """ Hold the lock as the writer
+        """
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                self._waiting += 1
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._waiting -= 1
+                self._writer = me
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+def _lock(s_class: str) -> RWLock:
+    """ Readers-writer lock guarding DATA and INDEXES of a class
+    """
+    lock = LOCKS.get(s_class)
+    if lock is None:
+        lock = LOCKS.setdefault(s_class, RWLock())
+    return lock
+
+
+def _io_lock(s_class: str) -> threading.RLock:
+    """ Lock serializing the writes to the files of a class
+    """
+    lock = IO_LOCKS.get(s_class)
+    if lock is None:
+        lock = IO_LOCKS.setdefault(s_class, threading.RLock())
+    return lock
+
+
+@contextmanager
+def _file_lock(s_class: str):
+    """ Exclusive access to the files of a class, for the threads (the
+    io lock) and the processes (flock of .db_<class>.lock); reentrant
+    """
+    with _io_lock(s_class):
+        if s_class in FILE_LOCKS or fcntl is None:
+            yield
+            return
+        with open(".db_{}.lock".format(s_class), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            FILE_LOCKS[s_class] = f
+            try:
+                yield
+            finally:
+                del FILE_LOCKS[s_class]
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Index():
+    """ Secondary hash index of one attribute: value -> object IDs
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index
+        """
+        self.attribute = attribute
+        self.ids = {}
+        self.values = {}
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index the current value of the attribute of obj
+        """
+        self.add_value(obj.id, getattr(obj, self.attribute, None))
+
+    def add_value(self, obj_id: str, value):
+        """ Index an object ID under value
+        """
+        if obj_id in self.values:
+            if self.values[obj_id] == value:
+                return
+            self.discard(obj_id)
+        try:
+            self.ids.setdefault(value, {})[obj_id] = None
+        except TypeError:
+            return
+        self.values[obj_id] = value
+
+    def discard(self, obj_id: str):
+        """ Remove an object ID from the index
+        """
+        if obj_id not in self.values:
+            return
+        value = self.values.pop(obj_id)
+        ids = self.ids[value]
+        del ids[obj_id]
+        if len(ids) == 0:
+            del self.ids[value]
+
+    def lookup(self, value) -> Iterable[str]:
+        """ IDs of the objects indexed with this value,
+        None if the value can't be looked up
+        """
+        try:
+            return self.ids.get(value, {})
+        except TypeError:
+            return None
+
+
+class DataFile():
+    """ Snapshot or journal scanned by a lazy store, kept open: the
+    offsets read in it stay valid when another process replaces or
+    removes the file
+    """
+
+    def __init__(self, file_path: str):
+        """ Open file_path for reading
+        """
+        self.path = file_path
+        self.file = open(file_path, 'rb')
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self._mutex = threading.Lock()
+
+    def line(self, offset: int) -> bytes:
+        """ Line starting at offset
+        """
+        with self._mutex:
+            self.file.seek(offset)
+            return self.file.readline()
+
+    def close(self):
+        """ Close the file
+        """
+        self.file.close()
+
+    def __del__(self):
+        """ Close the file once no location refers to it
+        """
+        if hasattr(self, 'file'):
+            self.file.close()
+
+
+class LazyStore(MutableMapping):
+    """ DATA entry of a class loaded with STORAGE_LAZY=1
+
+    Only the location (DataFile, offset) of each object is kept; objects
+    are read and built on access and kept in a LRU of LAZY_CACHE_SIZE
+    entries. Objects saved since the last snapshot are pinned in memory
+    until save_to_file writes them.
+    """
+
+    def __init__(self, cls, size: int):
+        """ Initialize an empty store for cls
+        """
+        self.cls = cls
+        self.size = size
+        self.locations = {}
+        self.files = {}
+        self.pinned = {}
+        self.cache = OrderedDict()
+        self._versions = {}
+        self._written = {}
+        self._clock = 0
+        self._mutex = threading.Lock()
+
+    def __getitem__(self, obj_id: str) -> TypeVar('Base'):
+        """ Object by ID, read from disk on a cache miss
+        """
+        obj = self.pinned.get(obj_id)
+        if obj is not None:
+            return obj
+        location = self.locations[obj_id]
+        with self._mutex:
+            obj = self.cache.get(obj_id)
+            if obj is not None:
+                self.cache.move_to_end(obj_id)
+                return obj
+        obj_json = self.read(location)
+        if obj_json.get('id') != obj_id:
+            raise KeyError(obj_id)
+        obj = self.cls(**obj_json)
+        with self._mutex:
+            self.cache[obj_id] = obj
+            if len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+        return obj
+
+    def __setitem__(self, obj_id: str, obj: TypeVar('Base')):
+        """ Pin a saved object until the next snapshot
+        """
+        with self._mutex:
+            self._clock += 1
+            self.pinned[obj_id] = obj
+            self._versions[obj_id] = self._clock
+            self.cache.pop(obj_id, None)
+            if obj_id not in self.locations:
+                self.locations[obj_id] = None
+
+    def __delitem__(self, obj_id: str):
+        """ Forget an object
+        """
+        with self._mutex:
+            del self.locations[obj_id]
+            self.pinned.pop(obj_id, None)
+            self._versions.pop(obj_id, None)
+            self.cache.pop(obj_id, None)
+
+    def __contains__(self, obj_id: str) -> bool:
+        """ Membership test without reading the object
+        """
+        return obj_id in self.locations
+
+    def __iter__(self):
+        """ Iterate over the IDs
+        """
+        return iter(self.locations)
+
+    def __len__(self) -> int:
+        """ Number of objects
+        """
+        return len(self.locations)
+
+    def locate(self, obj_id: str, location: tuple, obj_json: dict = None):
+        """ Record where the last state of an object is stored; a pinned
+        object whose JSON differs from obj_json (written by another
+        process) is unpinned
+        """
+        with self._mutex:
+            self.locations[obj_id] = location
+            self.cache.pop(obj_id, None)
+            obj = self.pinned.get(obj_id)
+            if obj is not None and obj_json is not None and \
+                    obj.serialize() != json.dumps(obj_json):
+                del self.pinned[obj_id]
+                del self._versions[obj_id]
+
+    def open(self, file_path: str) -> DataFile:
+        """ DataFile of file_path, shared with the locations already in
+        the same file
+        """
+        data_file = DataFile(file_path)
+        with self._mutex:
+            current = self.files.get(file_path)
+            if current is not None and current.inode == data_file.inode:
+                data_file.close()
+                return current
+            self.files[file_path] = data_file
+        return data_file
+
+    @staticmethod
+    def read(location: tuple) -> dict:
+        """ JSON dictionary stored at (DataFile, offset): a snapshot line
+        '"<id>": {...},' or a journal record
+        """
+        data_file, offset = location
+        line = data_file.line(offset).strip().rstrip(b',')
+        if data_file.path.endswith('.journal'):
+            return json.loads(line)['obj']
+        return json.loads(b'{' + line + b'}').popitem()[1]
+
+    def raw_items(self) -> Iterable[tuple]:
+        """ (ID, JSON text) of every object, for a snapshot rewrite,
+        without building the objects that are only on disk
+        """
+        decoder = json.JSONDecoder()
+        with self._mutex:
+            self._written = dict(self._versions)
+        for obj_id, location in list(self.locations.items()):
+            obj = self.pinned.get(obj_id) or self.cache.get(obj_id)
+            if obj is not None:
+                yield obj_id, obj.serialize()
+            elif location[0].path.endswith('.journal'):
+                yield obj_id, json.dumps(self.read(location))
+            else:
+                line = location[0].line(location[1])
+                line = line.decode().strip().rstrip(',')
+                _, end = decoder.raw_decode(line)
+                yield obj_id, line[end:].lstrip()[1:].lstrip()
+
+    def relocate(self, file_path: str, offsets: dict):
+        """ Point every object to the snapshot just written and unpin
+        the objects not saved again since raw_items
+        """
+        data_file = self.open(file_path)
+        with self._mutex:
+            for obj_id, offset in offsets.items():
+                if obj_id in self.locations:
+                    self.locations[obj_id] = (data_file, offset)
+                version = self._versions.get(obj_id)
+                if version is not None and \
+                        version == self._written.get(obj_id):
+                    self.cache[obj_id] = self.pinned.pop(obj_id)
+                    del self._versions[obj_id]
+            self._written = {}
+            while len(self.cache) > self.size:
+                self.cache.popitem(last=False)
+
+
+class EpochTimestamp():
+    """ Descriptor exposing as a naive UTC datetime a timestamp stored
+    in a slot as epoch seconds
+    """
+
+    def __init__(self, slot: str):
+        """ Initialize the descriptor over slot
+        """
+        self.slot = slot
+
+    def __get__(self, obj, objtype=None) -> datetime:
+        """ Datetime of the stored timestamp
+        """
+        if obj is None:
+            return self
+        return EPOCH + timedelta(seconds=getattr(obj, self.slot))
+
+    def __set__(self, obj, value: datetime):
+        """ Store the datetime, truncated to the second
+        """
+        setattr(obj, self.slot, (value - EPOCH) // timedelta(seconds=1))
 
 
 class Base():
     """ Base class
+
+    Subclasses declare the attributes to index in __indexes__: the
+    indexes are maintained by save/remove/load_from_file (so they follow
+    the saved state of the objects) and used by search.
+
+    With STORAGE_TYPE=sqlite the objects are stored in SQLite instead
+    of DATA and the queries run in SQL (see models.sqlite_store).
+
+    With MODELS_COMPACT=1 (read at import) the models use __slots__ and
+    keep the timestamps as epoch seconds, subclasses then list their
+    attributes in __slots__ too.
+
+    With MODELS_JSON_CACHE=1 (read at import) every object keeps its
+    JSON text once serialized, until an attribute is set or it is
+    saved: listings and snapshot rewrites skip the unchanged objects,
+    at the cost of the text held in memory.
     """
 
+    __indexes__ = ()
+
+    if COMPACT:
+        __slots__ = ('id', '_created_at', '_updated_at', '_json_cache')
+        created_at = EpochTimestamp('_created_at')
+        updated_at = EpochTimestamp('_updated_at')
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
         if DATA.get(s_class) is None:
-            DATA[s_class] = {}
+            DATA.setdefault(s_class, {})
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
         if kwargs.get('created_at') is not None:
@@ -44,11 +622,30 @@ class Base():
             return False
         return (self.id == other.id)
 
+    def __setattr__(self, name: str, value):
+        """ Set an attribute and drop the memoized JSON text
+        """
+        object.__setattr__(self, name, value)
+        if getattr(self, '_json_cache', None) is not None:
+            object.__setattr__(self, '_json_cache', None)
+
     def to_json(self, for_serialization: bool = False) -> dict:
-        """ Convert the object a JSON dictionary
+        """ Convert the object a JSON dictionary, decoded from the
+        memoized JSON text with MODELS_JSON_CACHE=1
+        """
+        if not JSON_CACHE:
+            return self._build_json(for_serialization)
+        result = json.loads(self.serialize())
+        if not for_serialization:
+            for key in [k for k in result if k[0] == '_']:
+                del result[key]
+        return result
+
+    def _build_json(self, for_serialization: bool) -> dict:
+        """ JSON dictionary of the attributes of the object
         """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self._attributes():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -57,56 +654,494 @@ class Base():
                 result[key] = value
         return result
 
+    def serialize(self) -> str:
+        """ JSON text of to_json(True), memoized with MODELS_JSON_CACHE=1
+        until an attribute is set or the object is saved
+        """
+        text = getattr(self, '_json_cache', None)
+        if text is None:
+            text = json.dumps(self._build_json(True))
+            if JSON_CACHE:
+                object.__setattr__(self, '_json_cache', text)
+        return text
+
+    def _attributes(self) -> Iterable[tuple]:
+        """ (name, value) of the attributes set on the object, in the
+        order __dict__ would hold them
+        """
+        if not COMPACT:
+            return [(name, value) for name, value in self.__dict__.items()
+                    if name != '_json_cache']
+        attributes = []
+        for klass in reversed(type(self).__mro__):
+            for name in klass.__dict__.get('__slots__', ()):
+                if name == '_json_cache':
+                    continue
+                if isinstance(getattr(klass, name.lstrip('_'), None),
+                              EpochTimestamp):
+                    name = name.lstrip('_')
+                try:
+                    attributes.append((name, getattr(self, name)))
+                except AttributeError:
+                    continue
+        return attributes
+
     @classmethod
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from file, then replay the journal
+
+        With STORAGE_LAZY=1 only the locations of the objects and their
+        indexed attributes are loaded (see LazyStore). Nothing is loaded
+        with STORAGE_TYPE=sqlite, the objects stay in the database.
         """
+        if _store() is not None:
+            return
+        if cls in DIRTY:
+            flush()
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        journal_path = ".db_{}.journal".format(s_class)
+        with _file_lock(s_class), _lock(s_class).write():
+            snapshot = _signature(file_path)
+            journal = _signature(journal_path)
+            DATA[s_class] = {}
+            INDEXES[s_class] = {}
+            if getenv('STORAGE_LAZY', '0') == '1':
+                offset = cls._load_lazy()
+            else:
+                offset = cls._load_eager()
+            FILE_STATE[s_class] = {'cls': cls, 'snapshot': snapshot,
+                                   'journal': journal and journal[0],
+                                   'offset': offset}
+
+    @classmethod
+    def refresh(cls):
+        """ Bring the objects up to date with the files of the class,
+        which other processes may have written; loads the class the
+        first time
+
+        Two stat calls tell whether anything changed; if so the files
+        are caught up with (see _catch_up).
+        """
+        if _store() is not None:
+            return
+        s_class = cls.__name__
+        if s_class not in FILE_STATE:
+            cls.load_from_file()
             return
+        if cls._changed() is not None:
+            with _file_lock(s_class):
+                cls._catch_up()
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def _changed(cls) -> tuple:
+        """ Signatures of the snapshot and the journal if either changed
+        since they were last read, None otherwise
+        """
+        s_class = cls.__name__
+        state = FILE_STATE[s_class]
+        snapshot = _signature(".db_{}.json".format(s_class))
+        journal = _signature(".db_{}.journal".format(s_class))
+        if snapshot == state['snapshot'] and (
+                journal is None or journal[0] == state['journal']
+                and journal[2] <= state['offset']):
+            return None
+        return snapshot, journal
 
     @classmethod
-    def save_to_file(cls):
-        """ Save all objects to file
+    def _catch_up(cls):
+        """ Apply what other processes wrote to the files since they were
+        last read, the file lock being held: a new snapshot is merged
+        object by object (unchanged objects are kept as is; a lazy store
+        is scanned again), new journal records are applied from the last
+        offset read. Objects with mutations not on disk yet keep their
+        in-memory state.
+        """
+        s_class = cls.__name__
+        if s_class not in FILE_STATE:
+            FILE_STATE[s_class] = {'cls': cls, 'snapshot': None,
+                                   'journal': None, 'offset': 0}
+        state = FILE_STATE[s_class]
+        changed = cls._changed()
+        if changed is None:
+            return
+        snapshot, journal = changed
+        with _lock(s_class).write():
+            objs = DATA.setdefault(s_class, {})
+            lazy = isinstance(objs, LazyStore)
+            kept = {obj_id: objs.get(obj_id)
+                    for obj_id in _pending_ids(cls)}
+            if snapshot != state['snapshot'] and lazy:
+                DATA[s_class] = {}
+                INDEXES[s_class] = {}
+                offset = cls._load_lazy()
+            else:
+                start = state['offset']
+                if snapshot != state['snapshot']:
+                    cls._merge_snapshot()
+                    start = 0
+                elif journal is None or journal[0] != state['journal']:
+                    start = 0
+                if lazy:
+                    offset = cls._locate_journal(start)
+                else:
+                    offset = cls._replay_journal(start)
+            objs = DATA[s_class]
+            for obj_id, obj in kept.items():
+                if obj is None:
+                    objs.pop(obj_id, None)
+                    for index in INDEXES.get(s_class, {}).values():
+                        index.discard(obj_id)
+                else:
+                    objs[obj_id] = obj
+                    cls._index(obj)
+            state.update(snapshot=snapshot, journal=journal and journal[0],
+                         offset=offset)
+
+    @classmethod
+    def _merge_snapshot(cls):
+        """ Make the objects match the snapshot, building only the
+        objects whose JSON differs from the one in memory
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
         objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        if path.exists(file_path):
+            with open(file_path, 'r') as f:
+                objs_json = json.load(f)
+        objs = DATA[s_class]
+        for obj_id in [i for i in objs if i not in objs_json]:
+            del objs[obj_id]
+            for index in INDEXES.get(s_class, {}).values():
+                index.discard(obj_id)
+        for obj_id, obj_json in objs_json.items():
+            current = objs.get(obj_id)
+            if current is not None and \
+                    current.serialize() == json.dumps(obj_json):
+                continue
+            obj = cls(**obj_json)
+            objs[obj_id] = obj
+            cls._index(obj)
+
+    @classmethod
+    def _load_eager(cls) -> int:
+        """ Build every object of the snapshot and the journal, return
+        the offset read up to in the journal
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        if path.exists(file_path):
+            with open(file_path, 'r') as f:
+                objs_json = json.load(f)
+                for obj_id, obj_json in objs_json.items():
+                    obj = cls(**obj_json)
+                    DATA[s_class][obj_id] = obj
+                    cls._index(obj)
+        return cls._replay_journal()
+
+    @classmethod
+    def _load_lazy(cls) -> int:
+        """ Scan the snapshot (one object per line) and the journal,
+        keeping only offsets and indexed values; return the offset read
+        up to in the journal
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        if path.exists(file_path):
+            with open(file_path, 'rb') as f:
+                one_per_line = f.readline().strip() == b'{'
+            if not one_per_line:
+                cls._load_eager()
+                cls._save_snapshot()
+                INDEXES[s_class] = {}
+
+        size = int(getenv('LAZY_CACHE_SIZE', str(LAZY_CACHE_SIZE)))
+        store = DATA[s_class] = LazyStore(cls, size)
+        if path.exists(file_path):
+            data_file = store.open(file_path)
+            f = data_file.file
+            f.seek(0)
+            offset = len(f.readline())
+            for line in f:
+                text = line.strip().rstrip(b',')
+                if text != b'}':
+                    obj_id, obj_json = json.loads(
+                        b'{' + text + b'}').popitem()
+                    store.locate(obj_id, (data_file, offset))
+                    cls._index_json(obj_id, obj_json)
+                offset += len(line)
+        return cls._locate_journal()
+
+    @classmethod
+    def _locate_journal(cls, start: int = 0) -> int:
+        """ Lazy counterpart of _replay_journal: record the location of
+        the objects saved in the journal from offset start
+        """
+        s_class = cls.__name__
+        store = DATA[s_class]
+        journal_path = ".db_{}.journal".format(s_class)
+        if not path.exists(journal_path):
+            return 0
+        data_file = store.open(journal_path)
+        f = data_file.file
+        f.seek(start)
+        offset = start
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record.get('op') == 'save':
+                obj_id = record['obj']['id']
+                store.locate(obj_id, (data_file, offset), record['obj'])
+                cls._index_json(obj_id, record['obj'])
+            elif record.get('id') in store:
+                del store[record['id']]
+                for index in INDEXES[s_class].values():
+                    index.discard(record['id'])
+            offset += len(line)
+        return offset
+
+    @classmethod
+    def save_to_file(cls):
+        """ Save all objects to file (atomically, one object per line)
+        and empty the journal
+
+        The files are locked against the other processes and caught up
+        with first, so what they wrote since the last read is kept.
+        """
+        if _store() is not None:
+            return
+        with _file_lock(cls.__name__):
+            cls._catch_up()
+            cls._save_snapshot()
+
+    @classmethod
+    def _save_snapshot(cls):
+        """ Write the objects in memory as the snapshot and remove the
+        journal, the file lock being held
+        """
+        s_class = cls.__name__
+        file_path = ".db_{}.json".format(s_class)
+        tmp_path = "{}.tmp".format(file_path)
+        lock = _lock(s_class)
+        with lock.read():
+            objs = DATA[s_class]
+            lazy = isinstance(objs, LazyStore)
+            if lazy:
+                offsets = cls._write_snapshot(tmp_path, objs.raw_items())
+            else:
+                items = list(objs.items())
+        if not lazy:
+            offsets = cls._write_snapshot(
+                tmp_path, ((obj_id, obj.serialize())
+                           for obj_id, obj in items))
+        with lock.write():
+            os.replace(tmp_path, file_path)
+            if lazy:
+                objs.relocate(file_path, offsets)
+            journal_path = ".db_{}.journal".format(s_class)
+            if path.exists(journal_path):
+                os.remove(journal_path)
+            if s_class in FILE_STATE:
+                FILE_STATE[s_class].update(
+                    snapshot=_signature(file_path), journal=None,
+                    offset=0)
+
+    @staticmethod
+    def _write_snapshot(file_path: str, items: Iterable[tuple]) -> dict:
+        """ Write (ID, JSON text) items as a JSON dictionary, one object
+        per line, and return the offset of each object
+        """
+        offsets = {}
+        with open(file_path, 'wb') as f:
+            f.write(b'{\n')
+            separator = b''
+            for obj_id, obj_json in items:
+                f.write(separator)
+                offsets[obj_id] = f.tell()
+                f.write('{}: {}'.format(json.dumps(obj_id),
+                                        obj_json).encode())
+                separator = b',\n'
+            f.write(b'\n}\n')
+        return offsets
+
+    @classmethod
+    def _replay_journal(cls, start: int = 0) -> int:
+        """ Apply the mutations appended to the journal from offset
+        start and return the offset after the last complete record;
+        objects already in the saved state are kept as is
+        """
+        s_class = cls.__name__
+        objs = DATA[s_class]
+        journal_path = ".db_{}.journal".format(s_class)
+        if not path.exists(journal_path):
+            return 0
+
+        with open(journal_path, 'rb') as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                offset += len(line)
+                if record.get('op') == 'save':
+                    current = objs.get(record['obj'].get('id'))
+                    if current is not None and \
+                            current.serialize() == json.dumps(record['obj']):
+                        continue
+                    obj = cls(**record['obj'])
+                    objs[obj.id] = obj
+                    cls._index(obj)
+                elif objs.pop(record.get('id'), None) is not None:
+                    for index in INDEXES[s_class].values():
+                        index.discard(record['id'])
+        return offset
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def _commit(cls, record: dict):
+        """ Persist one mutation: {'op': 'save', 'obj': ...} or
+        {'op': 'remove', 'id': ...}
+
+        With STORAGE_WRITE_BEHIND=1 the class is only marked dirty and
+        the background flusher writes it later (see flush).
+        """
+        if getenv('STORAGE_WRITE_BEHIND', '0') == '1':
+            _mark_dirty(cls, record)
+        else:
+            cls._write([record])
+
+    @classmethod
+    def _write(cls, records: List[dict]):
+        """ Write mutations of the class to disk
+
+        With STORAGE_TYPE=journal the records are appended to
+        .db_<class>.journal (after cutting a record torn by a crash),
+        compacted into the snapshot once the journal is over
+        JOURNAL_MAX_BYTES; otherwise the whole file is rewritten. When
+        the journal was read up to its end, the records appended are
+        marked as read, so refresh() doesn't apply them again.
+        """
+        if getenv('STORAGE_TYPE', 'file') != 'journal':
+            cls.save_to_file()
+            return
+
+        journal_path = ".db_{}.journal".format(cls.__name__)
+        with _file_lock(cls.__name__):
+            with open(journal_path, 'ab+') as f:
+                _drop_torn_record(f)
+                start = f.tell()
+                f.write(''.join(json.dumps(r) + '\n'
+                                for r in records).encode())
+                size = f.tell()
+                inode = os.fstat(f.fileno()).st_ino
+            state = FILE_STATE.get(cls.__name__)
+            if state is not None and state['offset'] == start and \
+                    (start == 0 or state['journal'] == inode):
+                state.update(journal=inode, offset=size)
+            maximum = int(getenv('JOURNAL_MAX_BYTES', str(JOURNAL_MAX_BYTES)))
+            if size > maximum:
+                cls.save_to_file()
 
     def save(self):
         """ Save current object
         """
         s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        object.__setattr__(self, '_json_cache', None)
+        store = _store()
+        if store is not None:
+            store.save([self])
+            return
+        with _in_flight(s_class, [self.id]):
+            with _lock(s_class).write():
+                DATA[s_class][self.id] = self
+                self.__class__._index(self)
+            self.__class__._commit({'op': 'save',
+                                    'obj': self.to_json(True)})
 
     def remove(self):
         """ Remove object
         """
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        store = _store()
+        if store is not None:
+            store.remove(self.__class__, self.id)
+            return
+        with _in_flight(s_class, [self.id]):
+            with _lock(s_class).write():
+                if self.id not in DATA[s_class]:
+                    return
+                del DATA[s_class][self.id]
+                for index in INDEXES.get(s_class, {}).values():
+                    index.discard(self.id)
+            self.__class__._commit({'op': 'remove', 'id': self.id})
+
+    @classmethod
+    def remove_many(cls, objs: Iterable[TypeVar('Base')]) -> int:
+        """ Remove objects in one pass, then write the store once (one
+        snapshot rewrite, or one SQL transaction); return the number of
+        objects removed
+        """
+        ids = [obj.id for obj in objs]
+        store = _store()
+        if store is not None:
+            store.remove(cls, *ids)
+            return len(ids)
+        if cls in DIRTY:
+            flush()
+        s_class = cls.__name__
+        removed = 0
+        with _in_flight(s_class, ids):
+            with _lock(s_class).write():
+                objs = DATA[s_class]
+                for obj_id in ids:
+                    if obj_id not in objs:
+                        continue
+                    del objs[obj_id]
+                    for index in INDEXES.get(s_class, {}).values():
+                        index.discard(obj_id)
+                    removed += 1
+            if removed > 0:
+                cls.save_to_file()
+        return removed
+
+    @classmethod
+    def _index(cls, obj: TypeVar('Base')):
+        """ Add or refresh obj in the indexes declared by the class
+        """
+        indexes = INDEXES.setdefault(cls.__name__, {})
+        for attribute in cls.__indexes__:
+            if attribute not in indexes:
+                indexes[attribute] = Index(attribute)
+            indexes[attribute].add(obj)
+
+    @classmethod
+    def _index_json(cls, obj_id: str, obj_json: dict):
+        """ Same as _index, from the JSON dictionary of an object
+        """
+        indexes = INDEXES.setdefault(cls.__name__, {})
+        for attribute in cls.__indexes__:
+            if attribute not in indexes:
+                indexes[attribute] = Index(attribute)
+            indexes[attribute].add_value(obj_id, obj_json.get(attribute))
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
+        store = _store()
+        if store is not None:
+            return store.count(cls)
         s_class = cls.__name__
-        return len(DATA[s_class].keys())
+        with _lock(s_class).read():
+            return len(DATA[s_class].keys())
 
     @classmethod
     def all(cls) -> Iterable[TypeVar('Base')]:
@@ -114,24 +1149,185 @@ class Base():
         """
         return cls.search()
 
+    @classmethod
+    def iterate(cls) -> Iterator[TypeVar('Base')]:
+        """ Yield all objects one at a time, over a snapshot of the IDs
+        """
+        store = _store()
+        if store is not None:
+            yield from store.search(cls)
+            return
+        with _lock(cls.__name__).read():
+            ids = list(DATA[cls.__name__].keys())
+        for obj_id in ids:
+            obj = cls.get(obj_id)
+            if obj is not None:
+                yield obj
+
+    @classmethod
+    def page(cls, after: str = None,
+             limit: int = 100) -> List[TypeVar('Base')]:
+        """ Up to limit objects by increasing ID, starting after the ID
+        after (keyset pagination: stable while objects come and go)
+        """
+        store = _store()
+        if store is not None:
+            return store.page(cls, after, limit)
+        with _lock(cls.__name__).read():
+            objs = DATA[cls.__name__]
+            ids = iter(list(objs.keys()))
+            if after is not None:
+                ids = (obj_id for obj_id in ids if obj_id > after)
+            page = [objs.get(obj_id)
+                    for obj_id in heapq.nsmallest(limit, ids)]
+        return [obj for obj in page if obj is not None]
+
     @classmethod
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
+        store = _store()
+        if store is not None:
+            return store.get(cls, id)
         s_class = cls.__name__
-        return DATA[s_class].get(id)
+        with _lock(s_class).read():
+            return DATA[s_class].get(id)
+
+    @classmethod
+    def query(cls, **attributes: dict) -> 'Query':
+        """ Lazy query of the objects with matching attributes
+        """
+        return Query(cls, attributes)
 
     @classmethod
-    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
+    def search(cls, attributes: dict = None) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
-        s_class = cls.__name__
-        def _search(obj):
-            if len(attributes) == 0:
-                return True
-            for k, v in attributes.items():
-                if (getattr(obj, k) != v):
-                    return False
-            return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+        return cls.query(**(attributes or {})).all()
+
+
+class Query():
+    """ Query over the saved objects of a class, built by Base.query and
+    refined with filter, order_by and limit; nothing runs until it is
+    iterated or first/exists/count/all is called
+
+    The candidates come from the most selective index of the filtered
+    attributes (or from SQL with STORAGE_TYPE=sqlite) and are read in
+    chunks of QUERY_CHUNK, so iteration stops as soon as enough objects
+    matched.
+    """
+
+    def __init__(self, cls, attributes: dict):
+        """ Initialize a query of the objects of cls matching attributes
+        """
+        self.cls = cls
+        self.attributes = attributes
+        self._order = None
+        self._limit = None
+
+    def _copy(self, **changes: dict) -> 'Query':
+        """ New query with some fields changed
+        """
+        query = Query(self.cls, self.attributes)
+        query._order = self._order
+        query._limit = self._limit
+        for name, value in changes.items():
+            setattr(query, name, value)
+        return query
+
+    def filter(self, **attributes: dict) -> 'Query':
+        """ Query also matching attributes
+        """
+        return self._copy(attributes={**self.attributes, **attributes})
+
+    def order_by(self, attribute: str) -> 'Query':
+        """ Query sorted by attribute, in descending order when it is
+        prefixed with '-'; None sorts first
+        """
+        return self._copy(_order=attribute)
+
+    def limit(self, n: int) -> 'Query':
+        """ Query of the first n objects at most
+        """
+        return self._copy(_limit=n)
+
+    def _match(self, obj: Base) -> bool:
+        """ True if obj has the attributes of the query
+        """
+        for k, v in self.attributes.items():
+            if getattr(obj, k) != v:
+                return False
+        return True
+
+    def _candidates(self) -> Iterator[Base]:
+        """ Objects that may match: those of the smallest index lookup,
+        all objects when no attribute is indexed
+        """
+        s_class = self.cls.__name__
+        lock = _lock(s_class)
+        with lock.read():
+            ids = None
+            indexes = INDEXES.get(s_class, {})
+            for k, v in self.attributes.items():
+                found = indexes[k].lookup(v) if k in indexes else None
+                if found is not None and (ids is None or
+                                          len(found) < len(ids)):
+                    ids = found
+            ids = list(DATA[s_class].keys() if ids is None else ids)
+        for start in range(0, len(ids), QUERY_CHUNK):
+            with lock.read():
+                objs = DATA[s_class]
+                chunk = [objs.get(obj_id)
+                         for obj_id in ids[start:start + QUERY_CHUNK]]
+            for obj in chunk:
+                if obj is not None:
+                    yield obj
+
+    def __iter__(self) -> Iterator[Base]:
+        """ Run the query
+        """
+        store = _store()
+        if store is not None:
+            return store.search(self.cls, self.attributes, self._order,
+                                self._limit)
+        matches = filter(self._match, self._candidates())
+        if self._order is None:
+            return itertools.islice(matches, self._limit)
+
+        attribute = self._order.lstrip('-')
+
+        def key(obj):
+            value = getattr(obj, attribute, None)
+            return (value is not None, value)
+
+        reverse = self._order.startswith('-')
+        if self._limit is None:
+            return iter(sorted(matches, key=key, reverse=reverse))
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        return iter(select(self._limit, matches, key=key))
+
+    def all(self) -> List[Base]:
+        """ List of the matching objects
+        """
+        return list(self)
+
+    def first(self) -> Base:
+        """ First matching object, None if there is none
+        """
+        return next(iter(self.limit(1)), None)
+
+    def exists(self) -> bool:
+        """ True if an object matches
+        """
+        return self.first() is not None
+
+    def count(self) -> int:
+        """ Number of matching objects
+        """
+        if self._limit is None:
+            store = _store()
+            if store is not None:
+                return store.count(self.cls, self.attributes)
+            if len(self.attributes) == 0:
+                return self.cls.count()
+        return sum(1 for _ in self)
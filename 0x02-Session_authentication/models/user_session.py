@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 """User session model"""
-from models.base import Base
+from models.base import Base, COMPACT
+import sys
 
 
 class UserSession(Base):
     """User session class"""
+
+    __indexes__ = ('session_id', 'user_id')
+
+    if COMPACT:
+        __slots__ = ('user_id', 'session_id')
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User session instance
         """
         super().__init__(*args, **kwargs)
         self.user_id = kwargs.get('user_id')
+        if COMPACT and isinstance(self.user_id, str):
+            self.user_id = sys.intern(self.user_id)
         self.session_id = kwargs.get('session_id')
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+""" Stress test of the models store: many threads saving, updating,
+removing, searching and listing users while the store is written to file
+
+Usage: [STORAGE_TYPE=journal|sqlite] [STORAGE_LAZY=1]
+    ./stress_base.py [threads]
+"""
+import os
+import sys
+import tempfile
+import threading
+from models.base import flush
+from models.user import User
+
+OPERATIONS = 300
+
+
+def worker(number: int, errors: list):
+    """ Create users, update half of them, remove a quarter, and read
+    """
+    try:
+        mine = []
+        for i in range(OPERATIONS):
+            user = User(email="w{}-{}@example.com".format(number, i))
+            user.save()
+            mine.append(user)
+            if i % 2 == 0:
+                user.first_name = "updated"
+                user.save()
+            if i % 4 == 0:
+                user.remove()
+                mine.remove(user)
+            email = "w{}-{}@example.com".format(number, i // 2)
+            User.search({'email': email})
+            if i % 50 == 0:
+                User.all()
+                User.count()
+        for user in mine:
+            if User.search({'email': user.email}) != [user]:
+                errors.append("lost update of {}".format(user.email))
+    except Exception as e:
+        errors.append(repr(e))
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    os.chdir(tempfile.mkdtemp())
+    User.load_from_file()
+    errors = []
+    threads = [threading.Thread(target=worker, args=(i, errors))
+               for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    flush()
+
+    expected = count * (OPERATIONS - OPERATIONS // 4)
+    if User.count() != expected:
+        errors.append("{} users in memory, {} expected".format(
+            User.count(), expected))
+    User.load_from_file()
+    if User.count() != expected:
+        errors.append("{} users on file, {} expected".format(
+            User.count(), expected))
+    for error in errors[:10]:
+        print(error)
+    print("OK" if not errors else "{} errors".format(len(errors)))
+    sys.exit(1 if errors else 0)
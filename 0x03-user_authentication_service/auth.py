@@ -5,6 +5,56 @@ from db import DB
 from user import User
 from sqlalchemy.orm.exc import NoResultFound
 from uuid import uuid4
+from functools import lru_cache
+from os import getenv
+import time
+
+DEFAULT_ROUNDS = 12
+
+
+def _calibrate_rounds(target_ms: float) -> int:
+    """Find the bcrypt cost factor whose verification takes about
+    target_ms on this machine.
+    Args:
+        target_ms (float): The verification latency budget in milliseconds.
+    Returns:
+        int: The cost factor, between 4 and 31.
+    """
+    password = b'calibration'
+    rounds = 4
+    while rounds < 31:
+        hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+        start = time.perf_counter()
+        bcrypt.checkpw(password, hashed)
+        if (time.perf_counter() - start) * 2000 > target_ms:
+            break
+        rounds += 1
+    return rounds
+
+
+@lru_cache(maxsize=None)
+def _bcrypt_rounds() -> int:
+    """Cost factor used for new hashes, calibrated once per process when
+    AUTH_BCRYPT_TARGET_MS is set, bcrypt's default otherwise.
+    Returns:
+        int: The cost factor.
+    """
+    target_ms = getenv('AUTH_BCRYPT_TARGET_MS')
+    if not target_ms:
+        return DEFAULT_ROUNDS
+    return _calibrate_rounds(float(target_ms))
+
+
+def _hash_cost(hashed_password: bytes) -> int:
+    """Read the cost factor of a bcrypt hash.
+    Args:
+        hashed_password (bytes): The hash, as $2b$<cost>$<salt+digest>.
+    Returns:
+        int: The cost factor.
+    """
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode('utf-8')
+    return int(hashed_password.split(b'$')[2])
 
 
 def _hash_password(password: str) -> bytes:
@@ -14,7 +64,7 @@ def _hash_password(password: str) -> bytes:
     Returns:
         bytes: The salted hash of the password.
     """
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(_bcrypt_rounds())
     hash_password = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hash_password
 
@@ -57,6 +107,8 @@ class Auth:
 
     def valid_login(self, email: str, password: str) -> bool:
         """Locate the user by email. If it exists, check the password.
+        A valid password stored with another cost factor than the current
+        one is rehashed so logins follow the calibrated latency.
 
         Args:
             email (str): User's email
@@ -71,7 +123,13 @@ class Auth:
                 return False
         except NoResultFound:
             return False
-        return bcrypt.checkpw(password.encode('utf-8'), user.hashed_password)
+        if not bcrypt.checkpw(password.encode('utf-8'),
+                              user.hashed_password):
+            return False
+        if _hash_cost(user.hashed_password) != _bcrypt_rounds():
+            self._db.update_user(user.id,
+                                 hashed_password=_hash_password(password))
+        return True
 
     def create_session(self, email: str) -> str:
         """Create a new session for the user with the given email.